@@ -0,0 +1,152 @@
+__all__ = [
+    "IndexAdvisor",
+]
+
+import threading
+from typing import Any, Dict, List, Optional, Tuple
+
+from sqlalchemy import Engine
+
+# Operators of where clauses which can not seek in an index, eq. 'like' may start with '%'
+_UNINDEXABLE_OPERATORS = {"!=", "not_in", "like"}
+
+
+def _index_columns(table) -> List[Tuple[str, ...]]:
+    """ Column names of the primary key, unique constraints and indexes of a table. """
+    sql_table = table.__table__
+    keys = [tuple(c.name for c in sql_table.primary_key.columns)]
+    for constraint in sql_table.constraints:
+        columns = tuple(getattr(constraint, "columns", ()).keys())
+        if columns:
+            keys.append(columns)
+    for index in sql_table.indexes:
+        keys.append(tuple(c.name for c in index.columns))
+    return keys
+
+
+def _explain(engine: Engine, statement, params: Optional[Dict[str, Any]] = None) -> Tuple[List[str], bool]:
+    """ Run EXPLAIN on a statement with its bound parameters.
+
+    :return The lines of the query plan and whether it scans the whole table.
+    """
+    dialect = engine.dialect.name
+    # Expand the parameters of 'in' clauses, left as placeholders until execution otherwise
+    state = statement.compile(dialect=engine.dialect).construct_expanded_state(params)
+    params = state.parameters
+    if state.positiontup:
+        params = tuple(params[name] for name in state.positiontup)
+
+    prefix = "EXPLAIN QUERY PLAN " if dialect == "sqlite" else "EXPLAIN "
+    with engine.connect() as conn:
+        rows = conn.exec_driver_sql(prefix + state.statement, params).mappings().all()
+
+    if dialect == "sqlite":
+        plan = [r["detail"] for r in rows]
+        # SEARCH seeks in an index, SCAN reads all rows, even through an index
+        full_scan = any(p.startswith("SCAN") for p in plan)
+    else:
+        plan = [", ".join(f"{k}={v}" for k, v in r.items()) for r in rows]
+        # 'index' reads the whole index
+        full_scan = any(str(r.get("type", "")).upper() in ("ALL", "INDEX") for r in rows)
+    return plan, full_scan
+
+
+class IndexAdvisor(object):
+    """ Record the where/order_by column combinations queried on each table, and report
+    the ones not served by any index.
+
+    Usage:
+        advisor = IndexAdvisor()
+        dbo.enable_index_advisor(advisor)
+        ...
+        advisor.report(engine)
+    """
+
+    def __init__(self) -> None:
+        self._lock = threading.Lock()
+        # (table, (where column, operator) pairs, order_by columns) -> [calls, sample where clauses]
+        self._accesses: Dict[Tuple[Any, Tuple[Tuple[str, str], ...], Tuple[str, ...]], List[Any]] = {}
+
+    def _after_fork(self) -> None:
+        # The lock may have been held by another thread
+        self._lock = threading.Lock()
+
+    def record(self,
+               table,
+               where: Dict[str, Any],
+               order_by: Tuple[str, ...] = (),
+               ) -> None:
+        # Imported here, as base_dbo records accesses into the advisor
+        from base_dbo import _is_operator_clause
+
+        where_columns = tuple(sorted(
+            (k, v[0] if _is_operator_clause(v) else "==") for k, v in where.items() if k in table.__table__.columns))
+        key = (table, where_columns, tuple(order_by))
+        with self._lock:
+            entry = self._accesses.get(key)
+            if entry is None:
+                # Keep the first clauses seen, to EXPLAIN a representative query
+                self._accesses[key] = [1, dict(where)]
+            else:
+                entry[0] += 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self._accesses.clear()
+
+    @staticmethod
+    def is_covered(table, where_columns: Tuple[Tuple[str, str], ...], order_columns: Tuple[str, ...]) -> bool:
+        """ Whether an index can serve the access, eq. its leading column is filtered on
+        by an operator seeking in it, or, without filters, is the leading ordering column.
+        """
+        seekable = tuple(k for k, op in where_columns if op not in _UNINDEXABLE_OPERATORS)
+        if where_columns and not seekable and not order_columns:
+            return False
+        where_columns = seekable
+        for columns in _index_columns(table):
+            if where_columns and columns[0] in where_columns:
+                return True
+            if not where_columns and order_columns and columns[0] == order_columns[0].lstrip("-"):
+                return True
+        return not where_columns and not order_columns
+
+    def report(self, engine: Optional[Engine] = None, only_uncovered: bool = True) -> List[Dict[str, Any]]:
+        """ Summarize the recorded accesses, the most frequent first.
+        :params engine - If given, each access is checked with EXPLAIN on it as well.
+        :params only_uncovered - Only report accesses with no covering index or scanning the table.
+
+        :return A list of dicts with keys: table, where, operators (of the where columns),
+                order_by, calls, covered, plan, full_scan.
+        """
+        # Imported here, as base_dbo records accesses into the advisor
+        from base_dbo import StatementBuilder
+
+        with self._lock:
+            accesses = [(k, list(v)) for k, v in self._accesses.items()]
+
+        reports = []
+        for (table, where_columns, order_columns), (calls, sample_where) in accesses:
+            covered = self.is_covered(table, where_columns, order_columns)
+            plan, full_scan = None, None
+            if engine is not None:
+                # EXPLAIN the statement select runs, eq. leaving out soft-deleted rows
+                # as the partial indexes of live rows expect
+                builder = StatementBuilder()
+                builder._table = table
+                select_plan = builder._select_plan(None, sample_where, list(order_columns) or None)
+                plan, full_scan = _explain(engine, select_plan.statement, select_plan.params)
+
+            if only_uncovered and covered and not full_scan:
+                continue
+            reports.append({
+                "table": table.__tablename__,
+                "where": [k for k, _ in where_columns],
+                "operators": [op for _, op in where_columns],
+                "order_by": list(order_columns),
+                "calls": calls,
+                "covered": covered,
+                "plan": plan,
+                "full_scan": full_scan,
+            })
+        reports.sort(key=lambda r: r["calls"], reverse=True)
+        return reports
@@ -0,0 +1,288 @@
+__all__ = [
+    "AsyncBaseDBO",
+]
+
+from itertools import islice
+from typing import Any, Dict, Iterable, List, Tuple, Optional, Union
+
+from sqlalchemy import insert as _insert
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession
+from sqlalchemy.sql import Select, Update, Delete
+
+from base_dbo import StatementBuilder, _TT, _RT
+from cache import MISSING
+from models import TableTombstone, TableVersion
+from retry_policy import retryable
+
+
+class AsyncBaseDBO(StatementBuilder[_TT]):
+    """ The asyncio counterpart of BaseDBO, running on an AsyncEngine.
+    Retries back off with asyncio.sleep, so the event loop is never blocked.
+    """
+
+    def __init__(self, engine: AsyncEngine) -> None:
+        self._engine = engine
+
+    async def create_table(self) -> None:
+        """ Create the table if it does not exist, along with the version sequence and
+        tombstones of versioned tables.
+        """
+        async with self._engine.begin() as conn:
+            await conn.run_sync(self._table.__table__.create, checkfirst=True)
+            if self.versioned:
+                await conn.run_sync(TableVersion.__table__.create, checkfirst=True)
+                await conn.run_sync(TableTombstone.__table__.create, checkfirst=True)
+        if self.versioned:
+            try:
+                async with self._engine.begin() as conn:
+                    await conn.execute(self._init_version_statement())
+            except IntegrityError:
+                # Started concurrently by another process
+                pass
+
+    async def _next_version(self, session: AsyncSession) -> Optional[int]:
+        """ Reserve the version stamped by a write, see BaseDBO._next_version. """
+        if not self.versioned:
+            return None
+        bump, current = self._version_statements()
+        await session.execute(bump)
+        return (await session.execute(current)).scalar_one()
+
+    @retryable(idempotent=False)
+    async def insert(self, **columns) -> None:
+        """ Insert a new record to the table. See BaseDBO.insert.
+        :params kwargs - Key-value format parameters
+
+        :return None
+        """
+        # Filter out attributes are not belonging to the table.
+        for k in list(columns.keys()):
+            if not hasattr(self._table, k):
+                del columns[k]
+
+        async with AsyncSession(self._engine) as session, session.begin():
+            columns.update(self._stamps(await self._next_version(session)))
+            replaced = self._replace_deleted([columns])
+            if replaced is not None:
+                await session.execute(*replaced)
+            session.add(self._table(**columns))
+        self._invalidate_cache()
+
+    async def insert_many(self,
+                          rows: Iterable[Dict[str, Any]],
+                          chunk_size: int = 1000,
+                          ) -> int:
+        """ Insert records to the table in batches, one transaction per chunk.
+        :params rows - Key-value format records
+        :params chunk_size - The number of rows per chunk (transaction)
+
+        :return The number of inserted rows.
+        """
+        if chunk_size <= 0:
+            raise ValueError(f"chunk_size must be positive, got {chunk_size}")
+
+        rows = iter(rows)
+        total = 0
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            total += await self._insert_chunk(chunk)
+        return total
+
+    @retryable(idempotent=False)
+    async def _insert_chunk(self, chunk: List[Dict[str, Any]]) -> int:
+        statement = self._insert_statement()
+        async with AsyncSession(self._engine) as session, session.begin():
+            stamps = self._stamps(await self._next_version(session))
+            replaced = self._replace_deleted(chunk)
+            if replaced is not None:
+                await session.execute(*replaced)
+            for params in self._insert_params(chunk, stamps):
+                await session.execute(statement, params)
+        self._invalidate_cache()
+        return len(chunk)
+
+    async def upsert(self,
+                     rows: Iterable[Dict[str, Any]],
+                     conflict_keys: Optional[List[str]] = None,
+                     update_columns: Optional[List[str]] = None,
+                     chunk_size: int = 1000,
+                     ) -> int:
+        """ Insert records, or update the existing ones having the same unique keys.
+        See BaseDBO.upsert.
+        """
+        if chunk_size <= 0:
+            raise ValueError(f"chunk_size must be positive, got {chunk_size}")
+        conflict_keys, update_columns = self._upsert_keys(conflict_keys, update_columns)
+
+        rows = iter(rows)
+        total = 0
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            self._check_conflict_keys(chunk, conflict_keys)
+            total += await self._upsert_chunk(chunk, conflict_keys, update_columns)
+        return total
+
+    @retryable()
+    async def _upsert_chunk(self,
+                            chunk: List[Dict[str, Any]],
+                            conflict_keys: Tuple[str, ...],
+                            update_columns: Optional[Tuple[str, ...]],
+                            ) -> int:
+        dialect = self._engine.dialect.name
+        async with AsyncSession(self._engine) as session, session.begin():
+            stamps = self._stamps(await self._next_version(session))
+            if self.soft_deletes:
+                stamps["deleted"] = False
+            for params in self._insert_params(chunk, stamps):
+                statement = self._upsert_statement(
+                    dialect, tuple(sorted(params[0])), conflict_keys, update_columns)
+                await session.execute(statement, params)
+        self._invalidate_cache()
+        return len(chunk)
+
+    @retryable()
+    async def delete(self,
+                     where: Dict[str, Any] = {},
+                     soft_deletion: bool = True,
+                     ) -> bool:
+        """ Delete a record from the table.
+        Deletions from versioned tables are recorded as tombstones (see BaseDBO.select_since).
+        :params where - The clauses for query
+        :params soft_deletion - Flag specifying conduct a soft-deletion or hard-deletion.
+                                Soft-deleted rows stay in the table until purged (see BaseDBO.purge_deleted).
+        """
+        if soft_deletion and not self.soft_deletes:
+            raise ValueError(f"Table '{self._table.__tablename__}' has no 'deleted' column for soft deletions")
+
+        async with AsyncSession(self._engine) as session, session.begin():
+            version = await self._next_version(session)
+            if version is not None:
+                statement, params = self._deleted_rows_statement(where)
+                tombstones = self._tombstones((await session.execute(statement, params)).all(), version)
+                if tombstones:
+                    await session.execute(_insert(TableTombstone), tombstones)
+
+            if soft_deletion:
+                statement, params = self._update_statement(
+                    {"deleted": True}, {"deleted": False, **where}, self._stamps(version))
+                await session.execute(statement, params)
+            else:
+                statement, params = self._delete_statement(where)
+                await session.execute(statement, params)
+        self._invalidate_cache()
+        if soft_deletion:
+            return True
+
+    @retryable()
+    async def update(self,
+                     fields: Dict[str, Any],
+                     where: Dict[str, Any]
+                     ) -> bool:
+        """ Update a record of the table.
+        :params fields - Columns to be updated.
+        :params where - Clauses for query.
+        """
+        async with AsyncSession(self._engine) as session, session.begin():
+            statement, params = self._update_statement(
+                fields, where, self._stamps(await self._next_version(session)))
+            await session.execute(statement, params)
+        self._invalidate_cache()
+
+    @retryable()
+    async def count(self, filter_by: Dict[str, Any] = {}) -> int:
+        """ Count the number of rows that meets the condition in the table.
+        :params filter_by - The clauses for query (See StatementBuilder.where)
+        :return The number of rows in the table.
+        """
+        entry, result = self._cache_lookup("count", filter_by)
+        if result is not MISSING:
+            return result
+
+        statement, params = self._count_statement(filter_by)
+
+        async with AsyncSession(self._engine) as session, session.begin():
+            result = (await session.execute(statement, params)).scalar()
+
+        return self._cache_store(entry, result)
+
+    @retryable()
+    async def count_by(self, *columns: str, where: Dict[str, Any] = {}) -> Dict[Any, int]:
+        """ Count the rows of each group of values of the columns. See BaseDBO.count_by.
+        """
+        entry, result = self._cache_lookup("count_by", columns, where)
+        if result is not MISSING:
+            return result
+
+        statement, params = self._count_by_statement(columns, where)
+
+        async with AsyncSession(self._engine) as session, session.begin():
+            result = self._count_by_result((await session.execute(statement, params)).all(), columns)
+
+        return self._cache_store(entry, result)
+
+    @retryable()
+    async def select(self,
+                     *columns: Optional[List[str]],
+                     where: Dict[str, Any] = {},
+                     order_by: Optional[Union[str, List[str]]] = None,
+                     paging: Optional[Tuple[int, int]] = None,
+                     after: Optional[str] = None,
+                     limit: Optional[int] = None,
+                     result_format: str = "dicts",
+                     ) -> Any:
+        """ Query a table and return rows meet the condition. See BaseDBO.select.
+        """
+        entry, result = self._cache_lookup("select", columns, where, order_by, paging, after, limit, result_format)
+        if result is not MISSING:
+            return result
+
+        plan = self._select_plan(columns, where, order_by, paging, after, limit)
+
+        async with AsyncSession(self._engine) as session, session.begin():
+            rows = (await session.execute(plan.statement, plan.params)).all()
+        self._record_rows(len(rows))
+        result = plan.result(rows, result_format)
+
+        return self._cache_store(entry, result)
+
+    async def get_many(self,
+                       column: str,
+                       values: Iterable[Any],
+                       *columns: Optional[List[str]],
+                       chunk_size: int = 500,
+                       ) -> List[Dict[str, Any]]:
+        """ Query rows whose column matches any of the values. See BaseDBO.get_many.
+        """
+        if chunk_size <= 0:
+            raise ValueError(f"chunk_size must be positive, got {chunk_size}")
+        if not hasattr(self._table, column):
+            raise ValueError(f"Unknown column '{column}' of table '{self._table.__tablename__}'")
+
+        values = list(dict.fromkeys(values))
+        result = []
+        for i in range(0, len(values), chunk_size):
+            result += await self.select(*columns, where={column: ["in", values[i:i + chunk_size]]})
+        return result
+
+    @retryable(idempotent=False)
+    async def execute(self,
+                      statement: Union[Select[_RT], Update, Delete],
+                      ) -> Union[None, List[_RT]]:
+        is_select = False
+
+        if isinstance(statement, (Select,)):
+            is_select = True
+
+        result = None
+        async with AsyncSession(self._engine) as session, session.begin():
+            rows = await session.execute(statement)
+            if is_select:
+                result = rows.all()
+        if not is_select:
+            self._invalidate_cache()
+        return result
@@ -2,24 +2,136 @@ __all__ = [
     "BaseDBO",
 ]
 
-from datetime import datetime
-from typing import Any, Dict, Generic, List, TypeVar, Tuple, Optional, Union
+import base64
+import heapq
+import json
+from collections import namedtuple
+from contextlib import contextmanager
+from datetime import datetime, timedelta, timezone
+from itertools import islice
+from typing import Any, Callable, Dict, FrozenSet, Generic, Hashable, Iterable, Iterator, List, TypeVar, Tuple, Optional, Union
 
+from sqlalchemy import and_, bindparam, exists, false, literal, or_, true
 from sqlalchemy import delete as _delete, func
+from sqlalchemy import insert as _insert
 from sqlalchemy import select as _select
 from sqlalchemy import update as _update
-from sqlalchemy import Engine
+from sqlalchemy import Engine, UniqueConstraint, inspect, text
+from sqlalchemy.exc import IntegrityError
 from sqlalchemy.orm import Session
-from sqlalchemy.sql import Select, Update, Delete
-from tenacity import retry, stop_after_attempt, wait_fixed
+from sqlalchemy.schema import CreateColumn
+from sqlalchemy.sql import Select, Update, Delete, Insert
+
+try:
+    import numpy
+except ImportError:
+    numpy = None
+
+from advisor import IndexAdvisor
+from cache import MISSING, QueryCache, freeze, get_table_cache, invalidate_table_cache
+from counters import install_counters
+from logger import logger
+from metrics import QueryStats
+from models import TableCount, TableTombstone, TableVersion
+from retry_policy import retryable
+from routing import ReplicaRouter, record_write
+from transaction import current_transaction, transaction
+from write_behind import WriteBehindBuffer
 
 # Type Annotation
 _TT = TypeVar("_TT", bound=Any)  # Generic type for table
 _RT = TypeVar("_RT", bound=Any)  # Generic type for queried rows
+_ST = TypeVar("_ST", bound=Any)  # Generic type for cached statements
+
+# Statements keyed by (table, shape), see StatementBuilder._statement
+_STATEMENT_CACHE_SIZE = 512
+_statements: Dict[Hashable, Any] = {}
+
+# Columns stamped on every write of versioned tables, see BaseDBO.select_since
+_VERSION_COLUMNS = ("row_version", "updated_at")
+
+
+def _encode_cursor(values: List[Any]) -> str:
+    values = [{"$dt": v.isoformat()} if isinstance(v, datetime) else v for v in values]
+    return base64.urlsafe_b64encode(json.dumps(values).encode()).decode()
+
+
+def _decode_cursor(cursor: str) -> List[Any]:
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except Exception:
+        raise ValueError(f"Invalid pagination cursor: {cursor!r}")
+    if not isinstance(values, list):
+        raise ValueError(f"Invalid pagination cursor: {cursor!r}")
+    return [datetime.fromisoformat(v["$dt"]) if isinstance(v, dict) and "$dt" in v else v
+            for v in values]
+
+
+# Operators of where clauses in the form of {column: [operator, value]}
+_OPERATORS = {
+    "==": lambda c, v: c == v,
+    "!=": lambda c, v: c != v,
+    "<": lambda c, v: c < v,
+    "<=": lambda c, v: c <= v,
+    ">": lambda c, v: c > v,
+    ">=": lambda c, v: c >= v,
+    "in": lambda c, v: c.in_(v),
+    "not_in": lambda c, v: c.not_in(v),
+    "between": lambda c, v: c.between(v[0], v[1]),
+    "like": lambda c, v: c.like(v),
+    "is_null": lambda c, v: c.is_(None) if v else c.is_not(None),
+}
+
 
+def _is_operator_clause(rhv: Any) -> bool:
+    return type(rhv) is list and len(rhv) == 2 and isinstance(rhv[0], str) and rhv[0] in _OPERATORS
 
-def retry_error_callback(retry_state):
-    print("retry fails. calling retry_error_callback")
+
+def _parameterize(clauses: Dict[str, Any],
+                  prefix: str,
+                  ) -> Tuple[Optional[Hashable], Dict[str, Any], Dict[str, Any]]:
+    """ Replace the values of where clauses by bound parameters.
+
+    :return The shape of clauses (None if they can not be parameterized), the clauses
+            with placeholders and the values of bound parameters.
+    """
+    shape = []
+    placeholders = {}
+    params = {}
+    for lhv, rhv in sorted(clauses.items(), key=lambda kv: kv[0]):
+        name = f"{prefix}_{lhv}"
+        if rhv is None:
+            # Keep 'IS NULL', as '= :param' never matches NULL
+            shape.append((lhv, None))
+            placeholders[lhv] = None
+        elif _is_operator_clause(rhv):
+            op, value = rhv
+            if op == "is_null" or value is None:
+                shape.append((lhv, op, bool(value) if op == "is_null" else None))
+                placeholders[lhv] = [op, value]
+            elif op == "between":
+                lo, hi = value
+                shape.append((lhv, op))
+                placeholders[lhv] = [op, [bindparam(f"{name}_lo"), bindparam(f"{name}_hi")]]
+                params[f"{name}_lo"], params[f"{name}_hi"] = lo, hi
+            else:
+                shape.append((lhv, op))
+                # An expanding parameter renders one bind per value at execution time
+                placeholders[lhv] = [op, bindparam(name, expanding=op in ("in", "not_in"))]
+                params[name] = list(value) if op in ("in", "not_in") else value
+        elif isinstance(rhv, (list, tuple, set, dict)):
+            return None, clauses, {}
+        else:
+            shape.append((lhv, "=="))
+            placeholders[lhv] = bindparam(name)
+            params[name] = rhv
+    return tuple(shape), placeholders, params
+
+
+def _column_array(values: List[Any]) -> Any:
+    if numpy is None:
+        return values
+    return numpy.asarray(values)
 
 
 def _map_timestamp(row: List[Any]):
@@ -29,79 +141,287 @@ def _map_timestamp(row: List[Any]):
         yield r
 
 
-class BaseDBO(Generic[_TT]):
-    _table: _TT
+_RESULT_FORMATS = ("dicts", "tuples", "records", "columns")
 
-    def __init__(self, engine: Engine) -> None:
-        self._engine = engine
-        self._table.__table__.create(self._engine, checkfirst=True)
+# Record classes keyed by (table, columns), see _record_class
+_record_classes: Dict[Tuple[Any, Tuple[str, ...]], type] = {}
+
+
+def _record_class(table, columns: Tuple[str, ...]) -> type:
+    key = (table, columns)
+    cls = _record_classes.get(key)
+    if cls is None:
+        cls = _record_classes[key] = namedtuple(f"{table.__name__}Record", columns)
+    return cls
+
+
+class _SelectPlan(object):
+    """ A built select statement and what is needed to format its rows. """
+
+    def __init__(self,
+                 table,
+                 statement: Select,
+                 columns: List[str],
+                 map_timestamps: bool,
+                 order_keys: List[Tuple[str, bool]],
+                 limit: Optional[int],
+                 params: Optional[Dict[str, Any]] = None,
+                 ) -> None:
+        self.table = table
+        self.statement = statement
+        self.columns = columns  # Leading columns of rows, followed by extra sort keys
+        self.map_timestamps = map_timestamps
+        self.order_keys = order_keys
+        self.limit = limit  # Not None for keyset pagination
+        self.params = params or {}  # Bound parameters of the statement
+
+    def format(self, rows, result_format: str = "dicts") -> Any:
+        """ Convert rows to the result format.
+        :params rows - Queried Core rows.
+        :params result_format - 'dicts' for a list of dicts, 'tuples' for a list of tuples,
+                                'records' for a list of named tuples, 'columns' for a dict
+                                of column lists (NumPy arrays if NumPy is installed).
+        """
+        columns = self.columns
+        n = len(columns)
+        if self.map_timestamps:
+            values = [tuple(_map_timestamp(r[:n])) for r in rows]
+        else:
+            values = [r[:n] for r in rows]
+
+        if result_format == "dicts":
+            return [dict(zip(columns, v)) for v in values]
+        if result_format == "tuples":
+            return values
+        if result_format == "records":
+            make = _record_class(self.table, tuple(columns))._make
+            return [make(v) for v in values]
+        if result_format == "columns":
+            transposed = list(zip(*values)) if values else [()] * n
+            return {c: _column_array(list(v)) for c, v in zip(columns, transposed)}
+        raise ValueError(f"Unknown result format '{result_format}', expect one of {_RESULT_FORMATS}")
+
+    def result(self, rows, result_format: str = "dicts") -> Any:
+        """ Format rows, along with the next cursor in keyset pagination mode.
+        """
+        result = self.format(rows, result_format)
+        if self.limit is None:
+            return result
+
+        next_cursor = None
+        if rows and len(rows) == self.limit:
+            last = rows[-1]._mapping
+            next_cursor = _encode_cursor([last[k] for k, _ in self.order_keys])
+        return result, next_cursor
+
+
+class StatementBuilder(Generic[_TT]):
+    """ Statement construction shared by the sync and async DBOs. """
+    _table: _TT
+    _cache: Optional[QueryCache] = None
+    _advisor: Optional[IndexAdvisor] = None
+    _stats: Optional[QueryStats] = None
+    _router: Optional[ReplicaRouter] = None
+    # Columns whose counts per value are kept in TableCount, see enable_counters
+    _counted_columns: FrozenSet[str] = frozenset()
+    # Columns of the unique constraint used by upsert by default
+    _conflict_keys: List[str] = []
+    use_statement_cache: bool = True
 
     @property
     def table(self):
         return self._table
 
-    @retry(reraise=True,
-           stop=stop_after_attempt(3),
-           wait=wait_fixed(0.1),
-           retry_error_callback=retry_error_callback
-           )
-    def insert(self, **columns) -> None:
-        """ Insert a new record to the table.
-        :params kwargs - Key-value format parameters
+    @property
+    def cache(self) -> Optional[QueryCache]:
+        return self._cache
 
-        :return None
+    def enable_cache(self, max_entries: int = 1024, ttl: float = 60) -> QueryCache:
+        """ Enable the read-through cache for select and count.
+        The cache is shared by all DBOs of the same table in the same database and gets
+        invalidated by any insert/update/delete issued through them.
+        :params max_entries - The maximum number of cached results (LRU eviction).
+        :params ttl - Seconds a cached result stays valid.
+
+        :return The cache of the table.
         """
-        # Filter out attributes are not belonging to the table.
-        for k in list(columns.keys()):
-            if not hasattr(self._table, k):
-                del columns[k]
+        self._cache = get_table_cache(self._engine, self._table.__tablename__, max_entries, ttl)
+        return self._cache
 
-        instance = self._table(**columns)
+    def enable_index_advisor(self, advisor: IndexAdvisor) -> None:
+        """ Record the where/order_by columns of every query into the advisor.
+        """
+        self._advisor = advisor
 
-        with Session(self._engine) as session, session.begin():
-            session.add(instance)
+    def enable_read_replicas(self, router: ReplicaRouter) -> None:
+        """ Run reads outside transactions on the engines picked by the router.
+        Cached results then come from the replicas too, and may lag like them.
+        """
+        self._router = router
 
-    @retry(reraise=True,
-           stop=stop_after_attempt(3),
-           wait=wait_fixed(0.1),
-           retry_error_callback=retry_error_callback
-           )
-    def delete(self,
-               where: Dict[str, Any] = {},
-               soft_deletion: bool = True,
-               ) -> bool:
-        """ Delete a record from the table.
-        :params where - The clauses for query
-        :params soft_deletion - Flag specifying conduct a soft-deletion or hard-deletion.
+    def enable_counters(self, *columns: str) -> None:
+        """ Read count and count_by of a single column from the counters kept in
+        TableCount, which must be installed (see BaseDBO.enable_counters).
         """
-        if soft_deletion:
-            self.update(fields={"deleted": True},
-                        where=where
-                        )
-            return True
+        self._counted_columns = frozenset(columns)
 
-        statement = _delete(self._table)
-        statement: Delete = self.where(statement, where, self._table)
+    def enable_stats(self, stats: QueryStats) -> None:
+        """ Report selected rows and retries into the statistics.
+        """
+        self._stats = stats
 
-        with Session(self._engine) as session, session.begin():
-            session.execute(statement)
+    def _record_rows(self, rows: int) -> None:
+        if self._stats is not None:
+            self._stats.record_rows(self._table.__tablename__, "select", rows)
 
-    @retry(reraise=True,
-           stop=stop_after_attempt(3),
-           wait=wait_fixed(0.1),
-           retry_error_callback=retry_error_callback
-           )
-    def update(self,
-               fields: Dict[str, Any],
-               where: Dict[str, Any]
-               ) -> bool:
-        """ Update a record of the table.
-        :params fields - Columns to be updated.
-        :params where - Clauses for query.
+    def _record_access(self,
+                       where: Dict[str, Any],
+                       order_by: Optional[Union[str, List[str]]] = None,
+                       ) -> None:
+        if self._advisor is None:
+            return
+        order_keys = self.order_keys(order_by, self._table) if order_by else []
+        self._advisor.record(self._table, where,
+                             tuple(f"-{k}" if is_desc else k for k, is_desc in order_keys))
+
+    def _invalidate_cache(self) -> None:
+        tx = current_transaction(self._engine)
+        if tx is not None:
+            # Defer until the transaction commits
+            tx.written_tables.add(self._table.__tablename__)
+            return
+        invalidate_table_cache(self._engine, self._table.__tablename__)
+        record_write()
+
+    def _cache_lookup(self, *args) -> Tuple[Optional[Tuple[Hashable, int]], Any]:
+        """ Look up the cached result of a read, keyed by its arguments.
+
+        :return The entry to store the result under with _cache_store (None if the read is
+                not cached), and the cached result or MISSING.
+        """
+        # Reads within a transaction may see uncommitted writes, never share them.
+        if self._cache is None or current_transaction(self._engine) is not None:
+            return None, MISSING
+        key = freeze(args)
+        # Taken before the read, so that a result read before a write is not stored after it
+        generation = self._cache.generation
+        return (key, generation), self._cache.get(key, MISSING)
+
+    def _cache_store(self, entry: Optional[Tuple[Hashable, int]], result: _RT) -> _RT:
+        """ Cache the result of a read missed by _cache_lookup, and return it. """
+        if entry is not None:
+            self._cache.put(entry[0], result, entry[1])
+        return result
+
+    def _insert_params(self,
+                       rows: List[Dict[str, Any]],
+                       stamps: Dict[str, Any] = {},
+                       ) -> List[List[Dict[str, Any]]]:
+        # Filter out attributes are not belonging to the table, then group rows by
+        # their key set, as an executemany requires identical parameters per row.
+        table_columns = self._table.__table__.columns
+        groups: Dict[Tuple[str, ...], List[Dict[str, Any]]] = {}
+        for row in rows:
+            params = {k: v for k, v in row.items() if k in table_columns}
+            params.update(stamps)
+            groups.setdefault(tuple(sorted(params)), []).append(params)
+        return list(groups.values())
+
+    def _insert_statement(self) -> Insert:
+        return self._statement(("insert",), lambda: _insert(self._table.__table__))
+
+    def _upsert_keys(self,
+                     conflict_keys: Optional[List[str]],
+                     update_columns: Optional[List[str]],
+                     ) -> Tuple[Tuple[str, ...], Optional[Tuple[str, ...]]]:
+        conflict_keys = tuple(conflict_keys or self._conflict_keys)
+        if not conflict_keys:
+            raise ValueError(f"No conflict keys specified for upserting table '{self._table.__tablename__}'")
+        table_columns = self._table.__table__.columns
+        for k in conflict_keys + tuple(update_columns or ()):
+            if k not in table_columns:
+                raise ValueError(f"Unknown column '{k}' of table '{self._table.__tablename__}'")
+        return conflict_keys, tuple(update_columns) if update_columns is not None else None
+
+    @staticmethod
+    def _check_conflict_keys(chunk: List[Dict[str, Any]], conflict_keys: Tuple[str, ...]) -> None:
+        for row in chunk:
+            missing = [k for k in conflict_keys if k not in row]
+            if missing:
+                raise ValueError(f"Rows to be upserted must have conflict keys {missing}")
+
+    def _upsert_statement(self,
+                          dialect: str,
+                          columns: Tuple[str, ...],
+                          conflict_keys: Tuple[str, ...],
+                          update_columns: Optional[Tuple[str, ...]],
+                          ) -> Insert:
+        """ Build an INSERT which updates the existing row on conflicts of unique keys.
+        :params dialect - The name of database dialect.
+        :params columns - The inserted columns.
+        :params conflict_keys - The columns of the unique constraint to detect conflicts.
+        :params update_columns - The columns updated on conflicts. None for all inserted
+                                 columns except the conflict keys.
         """
-        statement = _update(self._table)
-        statement: Update = self.where(statement, where, self._table)
+        candidates = columns if update_columns is None else update_columns
+        set_columns = tuple(c for c in candidates if c in columns and c not in conflict_keys)
+        if set_columns:
+            # Updated rows get stamped too, and soft-deleted ones revived
+            set_columns += tuple(c for c in (*_VERSION_COLUMNS, "deleted") if c in columns and c not in set_columns)
 
+        def build():
+            table = self._table.__table__
+            if dialect in ("sqlite", "postgresql"):
+                if dialect == "sqlite":
+                    from sqlalchemy.dialects.sqlite import insert
+                else:
+                    from sqlalchemy.dialects.postgresql import insert
+                statement = insert(table)
+                if not set_columns:
+                    return statement.on_conflict_do_nothing(index_elements=list(conflict_keys))
+                return statement.on_conflict_do_update(
+                    index_elements=list(conflict_keys),
+                    set_={c: statement.excluded[c] for c in set_columns})
+            elif dialect in ("mysql", "mariadb"):
+                from sqlalchemy.dialects.mysql import insert
+                statement = insert(table)
+                # Assigning a conflict key to itself is the no-op update of MySQL
+                set_columns_ = set_columns or conflict_keys[:1]
+                return statement.on_duplicate_key_update(
+                    {c: statement.inserted[c] for c in set_columns_})
+            raise NotImplementedError(f"Upsert is not supported for database '{dialect}'")
+
+        return self._statement(("upsert", dialect, columns, conflict_keys, set_columns), build)
+
+    def _statement(self, shape: Optional[Hashable], build: Callable[[], _ST]) -> _ST:
+        """ Get the statement of the given shape, building it on first use.
+        Statements of a shape only differ in bound parameters, so a cached one skips the
+        construction and lets SQLAlchemy reuse its compiled form. None shape for no caching.
+        """
+        if shape is None or not self.use_statement_cache:
+            return build()
+        key = (self._table, shape)
+        statement = _statements.get(key)
+        if statement is None:
+            if len(_statements) >= _STATEMENT_CACHE_SIZE:
+                _statements.clear()
+            statement = _statements[key] = build()
+        return statement
+
+    def _delete_statement(self, where: Dict[str, Any]) -> Tuple[Delete, Dict[str, Any]]:
+        self._record_access(where)
+        where_shape, where, params = _parameterize(where, "w")
+        shape = ("delete", where_shape) if where_shape is not None else None
+
+        statement = self._statement(
+            shape, lambda: self.where(_delete(self._table), where, self._table))
+        return statement, params
+
+    def _update_statement(self,
+                          fields: Dict[str, Any],
+                          where: Dict[str, Any],
+                          stamps: Dict[str, Any] = {},
+                          ) -> Tuple[Update, Dict[str, Any]]:
         # Filter out attributes are not belonging to the table.
         # 同时过滤None值
         for k in list(fields.keys()):
@@ -109,107 +429,358 @@ class BaseDBO(Generic[_TT]):
                 del fields[k]
             elif fields[k] is None:
                 del fields[k]
-        statement = statement.values(**fields)
+        fields = {**fields, **stamps}
 
-        with Session(self._engine) as session, session.begin():
-            session.execute(statement)
+        self._record_access(where)
+        where_shape, where, params = _parameterize(where, "w")
+        shape = ("update", tuple(sorted(fields)), where_shape) if where_shape is not None else None
+        values = {k: bindparam(f"v_{k}") for k in fields}
+        params.update((f"v_{k}", v) for k, v in fields.items())
 
-    @retry(reraise=True,
-           stop=stop_after_attempt(3),
-           wait=wait_fixed(0.1),
-           retry_error_callback=retry_error_callback
-           )
-    def count(self, filter_by: Dict[str, Any] = {}) -> int:
-        """ Count the number of rows that meets the condition in the table.
-        :params where - The clauses for query
-        :return The number of rows in the table.
+        def build():
+            statement = _update(self._table)
+            statement: Update = self.where(statement, where, self._table)
+            return statement.values(**values)
+
+        return self._statement(shape, build), params
+
+    def _update_many_params(self,
+                            updates: Iterable[Tuple[Dict[str, Any], Dict[str, Any]]],
+                            ) -> Dict[Tuple[Tuple[str, ...], Tuple[str, ...]], List[Dict[str, Any]]]:
+        """ Group (key, fields) pairs by their (key columns, field columns), each group
+        being executed as one executemany. None fields are filtered out, as by update.
         """
-        # statement = _select(self._table)
+        groups = {}
+        table_columns = self._table.__table__.columns
+        for key, fields in updates:
+            for k in key:
+                if k not in table_columns:
+                    raise ValueError(f"Unknown column '{k}' of table '{self._table.__tablename__}'")
+            fields = {k: v for k, v in fields.items() if v is not None and hasattr(self._table, k)}
+            if not fields:
+                continue
+            params = {f"k_{k}": v for k, v in key.items()}
+            params.update((f"v_{k}", v) for k, v in fields.items())
+            groups.setdefault((tuple(sorted(key)), tuple(sorted(fields))), []).append(params)
+        return groups
 
-        # Construct the query statement
-        # statement = self.where(statement, where, self._table)
+    def _update_many_statement(self, key_columns: Tuple[str, ...], fields: Tuple[str, ...]) -> Update:
+        def build():
+            # A Core table, as ORM bulk updates only match rows by primary key
+            table = self._table.__table__
+            return _update(table).where(
+                *(table.c[k] == bindparam(f"k_{k}") for k in key_columns)
+            ).values({table.c[k]: bindparam(f"v_{k}") for k in fields})
 
-        with Session(self._engine) as session, session.begin():
-            return session.query(func.count()).select_from(self._table).filter_by(**filter_by).scalar()
+        return self._statement(("update_many", key_columns, fields), build)
 
-    @retry(reraise=True,
-           stop=stop_after_attempt(3),
-           wait=wait_fixed(0.1),
-           retry_error_callback=retry_error_callback
-           )
-    def select(self,
-               *columns: Optional[List[str]],
-               where: Dict[str, Any] = {},
-               order_by: Optional[Union[str, List[str]]] = None,
-               paging: Optional[Tuple[int, int]] = None,
-               ) -> List[Dict[str, Any]]:
-        """ Query a table and return rows meet the condition.
-        :params columns - Specify wanted columns. None for all columns (eq. SELECT *)
-        :params where - Specify the where clauses (Only support equality clauses)
-        :params order_by - Specify the column(s) by which results will get ordered. None for no ordering.
-        :params paging - Specify the paging info for picking part of rows of the table
+    @property
+    def versioned(self) -> bool:
+        """ Whether writes stamp the rows with a version, see BaseDBO.select_since. """
+        return "row_version" in self._table.__table__.columns
 
-        :return A list of queried values.
+    @property
+    def soft_deletes(self) -> bool:
+        """ Whether the table has a 'deleted' column. Soft-deleted rows are then left out
+        of select, count and iter_select, unless their clauses filter 'deleted' themselves.
         """
-        column_clauses = []
-        if columns:
-            for col in columns:
-                if hasattr(self._table, col):
-                    column_clauses.append(getattr(self._table, col))
+        return "deleted" in self._table.__table__.columns
 
-        if column_clauses:
-            statement = _select(*column_clauses)
-        else:
-            statement = _select(self._table)
+    def _live(self, statement: Union[Select[_RT], Update], where: Dict[str, Any]) -> Union[Select[_RT], Update]:
+        """ Leave out soft-deleted rows, unless the clauses filter 'deleted'.
+        The literal 'deleted = 0' lets SQLite use the partial indexes of live rows.
+        """
+        if not self.soft_deletes or "deleted" in where:
+            return statement
+        return statement.where(~self._table.__table__.c.deleted)
 
-        # Construct the query statement
-        statement = self.where(statement, where, self._table)
-        statement = self.page(
-            statement, page=paging[0], page_size=paging[1]) if paging else statement
-        statement = self.order_by(
-            statement, order_by, self._table) if order_by else statement
+    @staticmethod
+    def _stamps(version: Optional[int]) -> Dict[str, Any]:
+        if version is None:
+            return {}
+        return {"row_version": version, "updated_at": datetime.now(timezone.utc).replace(tzinfo=None)}
 
-        # Execute the SQL
-        with Session(self._engine) as session, session.begin():
-            rows = session.execute(statement).all()
+    def _init_version_statement(self) -> Insert:
+        """ Start the version sequence of the table from its last stamped version. """
+        table = TableVersion.__table__
+        name = self._table.__tablename__
+        return _insert(table).from_select(
+            ["table_name", "version"],
+            _select(literal(name), func.coalesce(func.max(self._table.__table__.c.row_version), 0))
+            .where(~exists().where(table.c.table_name == name)))
 
-            # Unify the return value's format to a dict
-            if column_clauses:
-                columns = [qc.name for qc in column_clauses]
-                result = [dict(zip(columns, _map_timestamp(r))) for r in rows]
+    def _version_statements(self) -> Tuple[Update, Select]:
+        """ Statements to bump the version of the table, then read it. """
+        def build():
+            table = TableVersion.__table__
+            match = table.c.table_name == self._table.__tablename__
+            return (_update(table).where(match).values(version=table.c.version + 1),
+                    _select(table.c.version).where(match))
+
+        return self._statement(("next_version",), build)
+
+    def _deleted_rows_statement(self, where: Dict[str, Any]) -> Tuple[Select, Dict[str, Any]]:
+        """ Select the ids and unique keys of the rows to be deleted, locking them. """
+        where_shape, where, params = _parameterize(where, "w")
+        shape = ("deleted_rows", where_shape) if where_shape is not None else None
+
+        def build():
+            table = self._table.__table__
+            statement = _select(table.c.id, *(table.c[k] for k in self._conflict_keys))
+            # Soft-deleted rows already have their tombstones
+            statement = self._live(self.where(statement, where, self._table), where)
+            return statement.with_for_update()
+
+        return self._statement(shape, build), params
+
+    def _tombstones(self, rows: List[Any], version: int) -> List[Dict[str, Any]]:
+        deleted_at = datetime.now(timezone.utc).replace(tzinfo=None)
+        return [{"table_name": self._table.__tablename__,
+                 "row_id": row[0],
+                 "row_key": json.dumps(dict(zip(self._conflict_keys, row[1:]))),
+                 "version": version,
+                 "deleted_at": deleted_at}
+                for row in rows]
+
+    def _replace_deleted(self, rows: List[Dict[str, Any]]) -> Optional[Tuple[Delete, List[Dict[str, Any]]]]:
+        """ Hard-delete the soft-deleted rows holding the unique keys of rows about to be
+        inserted, which would otherwise stay taken until purged. Their deletion is already
+        recorded by tombstones.
+
+        :return The statement and its executemany parameters, None if no row has a key.
+        """
+        if not self.soft_deletes or not self._conflict_keys:
+            return None
+        params = [{f"c_{k}": row[k] for k in self._conflict_keys} for row in rows
+                  if all(row.get(k) is not None for k in self._conflict_keys)]
+        if not params:
+            return None
+
+        def build():
+            table = self._table.__table__
+            return _delete(table).where(table.c.deleted == true(),
+                                        *(table.c[k] == bindparam(f"c_{k}") for k in self._conflict_keys))
+
+        return self._statement(("replace_deleted",), build), params
+
+    def _purge_statements(self, tombstones: bool) -> Tuple[Select, Delete]:
+        """ Statements to select a batch of ids of the soft-deleted rows (or tombstones)
+        deleted before the bound 'cutoff', then delete them by ids.
+        """
+        def build():
+            if tombstones:
+                table = TableTombstone.__table__
+                old = and_(table.c.table_name == self._table.__tablename__,
+                           table.c.deleted_at < bindparam("cutoff"))
             else:
-                result = [r[0].to_dict() for r in rows]
+                table = self._table.__table__
+                old = and_(table.c.deleted == true(), table.c.updated_at < bindparam("cutoff"))
+            return (_select(table.c.id).where(old).limit(bindparam("p_limit")),
+                    _delete(table).where(table.c.id.in_(bindparam("ids", expanding=True))))
 
-        return result
+        return self._statement(("purge", tombstones), build)
 
-    @retry(reraise=True,
-           stop=stop_after_attempt(3),
-           wait=wait_fixed(0.1),
-           retry_error_callback=retry_error_callback
-           )
-    def execute(self,
-                statement: Union[Select[_RT], Update, Delete],
-                ) -> Union[None, List[_RT]]:
-        is_select = False
+    def _changes_statements(self,
+                            after: bool,
+                            ) -> Tuple[Select, Select]:
+        """ Statements selecting a page of changed rows and one of tombstones, ordered
+        by (version, id) after the bound 'version' and 'id' (or from the bound 'version').
+        """
+        def build():
+            table = self._table.__table__
+            default_columns = getattr(self._table, "_default_select_columns", None) or table.columns.keys()
+            columns = list(dict.fromkeys(["id", *default_columns, *_VERSION_COLUMNS]))
+            rows = _select(*(table.c[c] for c in columns)).order_by(table.c.row_version, table.c.id)
+            # Soft-deleted rows come as their tombstones
+            rows = self._live(rows, {})
 
-        if isinstance(statement, (Select,)):
-            is_select = True
+            tombstones = TableTombstone.__table__
+            deleted = _select(tombstones.c.id, tombstones.c.row_id, tombstones.c.row_key,
+                              tombstones.c.version, tombstones.c.deleted_at
+                              ).where(tombstones.c.table_name == self._table.__tablename__
+                                      ).order_by(tombstones.c.version, tombstones.c.id)
+            if after:
+                rows = self.seek(rows, [("row_version", False), ("id", False)], self._table,
+                                 [bindparam("version"), bindparam("id")])
+                deleted = self.seek(deleted, [("version", False), ("id", False)], TableTombstone,
+                                    [bindparam("version"), bindparam("id")])
+            else:
+                rows = rows.where(table.c.row_version > bindparam("version"))
+                deleted = deleted.where(tombstones.c.version > bindparam("version"))
+            return rows.limit(bindparam("p_limit")), deleted.limit(bindparam("p_limit"))
 
-        result = None
-        with Session(self._engine) as session, session.begin():
-            rows = session.execute(statement)
-            if is_select:
-                result = rows.all()
-        return result
+        return self._statement(("changes", after), build)
+
+    def _count_statement(self, filter_by: Dict[str, Any]) -> Tuple[Select, Dict[str, Any]]:
+        if len(filter_by) == 1:
+            (column, value), = filter_by.items()
+            if (column in self._counted_columns and not _is_operator_clause(value)
+                    and not isinstance(value, (list, tuple, set, dict))):
+                return self._counter_statement(column, value)
+
+        self._record_access(filter_by)
+        where_shape, filter_by, params = _parameterize(filter_by, "w")
+        shape = ("count", where_shape) if where_shape is not None else None
+
+        statement = self._statement(shape, lambda: self._live(
+            self.where(_select(func.count()).select_from(self._table), filter_by, self._table), filter_by))
+        return statement, params
+
+    def _counter_statement(self, column: str, value: Any) -> Tuple[Select, Dict[str, Any]]:
+        """ Read the count of rows whose column has the value from TableCount. """
+        params = {"c_table": self._table.__tablename__, "c_column": column}
+
+        def build():
+            statement = _select(func.coalesce(func.sum(TableCount.count), 0)).where(
+                TableCount.table_name == bindparam("c_table"),
+                TableCount.column_name == bindparam("c_column"))
+            if value is None:
+                return statement.where(TableCount.value.is_(None))
+            return statement.where(TableCount.value == bindparam("c_value"))
+
+        if value is not None:
+            params["c_value"] = value
+        return self._statement(("counter", value is None), build), params
+
+    def _count_by_statement(self,
+                            columns: Tuple[str, ...],
+                            where: Dict[str, Any],
+                            ) -> Tuple[Select, Dict[str, Any]]:
+        """ :return A statement of rows (*values of columns, count). """
+        if not columns:
+            raise ValueError("count_by needs at least one column")
+        for c in columns:
+            if not hasattr(self._table, c):
+                raise ValueError(f"Unknown column '{c}' of table '{self._table.__tablename__}'")
+
+        if not where and len(columns) == 1 and columns[0] in self._counted_columns:
+            params = {"c_table": self._table.__tablename__, "c_column": columns[0]}
+            # Concurrent first inserts of a value may each add its row, so sum them as
+            # _counter_statement does
+            total = func.sum(TableCount.count)
+            statement = self._statement(("counters",), lambda: _select(TableCount.value, total).where(
+                TableCount.table_name == bindparam("c_table"),
+                TableCount.column_name == bindparam("c_column")).group_by(TableCount.value).having(total > 0))
+            return statement, params
+
+        self._record_access(where)
+        where_shape, where, params = _parameterize(where, "w")
+        shape = ("count_by", columns, where_shape) if where_shape is not None else None
+
+        def build():
+            group = [getattr(self._table, c) for c in columns]
+            statement = _select(*group, func.count()).group_by(*group)
+            return self._live(self.where(statement, where, self._table), where)
+
+        return self._statement(shape, build), params
+
+    @staticmethod
+    def _count_by_result(rows: List[Any], columns: Tuple[str, ...]) -> Dict[Any, int]:
+        if len(columns) == 1:
+            return {row[0]: row[1] for row in rows}
+        return {tuple(row[:-1]): row[-1] for row in rows}
+
+    def _column_clauses(self, columns) -> Tuple[List[Any], bool]:
+        """ Get the Core columns to be selected, and whether their datetime values get
+        formatted. Without wanted columns, the table's default columns are selected as is
+        (eq. ToDictMixin.to_dict), so rows are never hydrated into ORM instances.
+        """
+        table_columns = self._table.__table__.columns
+        column_clauses = [table_columns[c] for c in columns or () if c in table_columns]
+        if column_clauses:
+            return column_clauses, True
+        default_columns = getattr(self._table, "_default_select_columns", None) or table_columns.keys()
+        return [table_columns[c] for c in default_columns], False
+
+    def _select_plan(self,
+                     columns,
+                     where: Dict[str, Any],
+                     order_by: Optional[Union[str, List[str]]],
+                     paging: Optional[Tuple[int, int]] = None,
+                     after: Optional[str] = None,
+                     limit: Optional[int] = None,
+                     ) -> _SelectPlan:
+        keyset = limit is not None
+        if keyset and paging:
+            raise ValueError("'paging' and 'limit' can not be used together")
+        if after is not None and not keyset:
+            raise ValueError("'after' requires 'limit' to be specified")
+        paged = bool(paging) and bool(paging[1]) and paging[0] > 0
+        self._record_access(where, order_by)
+
+        where_shape, where, params = _parameterize(where, "w")
+        # NULL sort keys of the cursor are compared by IS NULL rather than bound
+        values = _decode_cursor(after) if after is not None else None
+        nulls = tuple(v is None for v in values) if values is not None else None
+        shape = None
+        if where_shape is not None:
+            shape = ("select", freeze(columns), where_shape, freeze(order_by), paged,
+                     keyset, nulls)
+
+        def build() -> _SelectPlan:
+            column_clauses, map_timestamps = self._column_clauses(columns)
+
+            # In keyset mode, rows are always ordered by a unique key ending with 'id',
+            # and the sort columns are selected too so that the next cursor can be built.
+            keys = self.order_keys(order_by, self._table) if order_by else []
+            clauses = order_by
+            if keyset:
+                if "id" not in [k for k, _ in keys]:
+                    keys.append(("id", False))
+                clauses = [f"-{k}" if is_desc else k for k, is_desc in keys]
+
+            extra_clauses = []
+            if keyset:
+                names = [qc.name for qc in column_clauses]
+                table_columns = self._table.__table__.columns
+                extra_clauses = [table_columns[k] for k, _ in keys if k not in names]
+
+            statement = _select(*column_clauses, *extra_clauses)
+
+            # Construct the query statement
+            statement = self._live(self.where(statement, where, self._table), where)
+            statement = self.order_by(
+                statement, clauses, self._table) if clauses else statement
+            if keyset:
+                if after is not None:
+                    statement = self.seek(statement, keys, self._table,
+                                          [None if is_null else bindparam(f"k_{i}")
+                                           for i, is_null in enumerate(nulls)])
+                statement = statement.limit(bindparam("p_limit"))
+            elif paged:
+                statement = statement.offset(bindparam("p_offset")).limit(bindparam("p_limit"))
+
+            return _SelectPlan(self._table, statement, [qc.name for qc in column_clauses],
+                               map_timestamps, keys, None)
+
+        template = self._statement(shape, build)
+
+        if keyset:
+            params["p_limit"] = limit
+            if after is not None:
+                if len(values) != len(template.order_keys):
+                    raise ValueError("The cursor does not match the ordering columns")
+                params.update((f"k_{i}", v) for i, v in enumerate(values) if v is not None)
+        elif paged:
+            params["p_offset"] = (paging[0] - 1) * paging[1]
+            params["p_limit"] = paging[1]
+
+        return _SelectPlan(self._table, template.statement, template.columns, template.map_timestamps,
+                           template.order_keys, limit, params)
 
     @staticmethod
     def where(statement: Union[Select[_RT], Update, Delete],
               clauses: Dict[str, Any],
               table,
               ) -> Union[Select[_RT], Update, Delete]:
-        """ Filter out some rows based on equality clauses.
+        """ Filter out some rows based on clauses.
         :params statement - The select query statement.
-        :params clauses - The where clauses.
+        :params clauses - The where clauses. A value is either compared for equality, or
+                          given as [operator, value] with operators:
+                          '==', '!=', '<', '<=', '>', '>=', 'like',
+                          'in' / 'not_in' (value is a list),
+                          'between' (value is [low, high]),
+                          'is_null' (value is True for IS NULL, False for IS NOT NULL)
         :params table - Specify the table class to be queried.
 
         :return A new query statement
@@ -217,33 +788,27 @@ class BaseDBO(Generic[_TT]):
         for lhv, rhv in clauses.items():
             # lhv: left-hand value, rhv: right-hand value
             if hasattr(table, lhv):
-                if type(rhv) is list and len(rhv) == 2 and rhv[0] in ["<=", ">="]:
-                    if rhv[0] == "<=":
-                        statement = statement.where(
-                            getattr(table, lhv) <= rhv[1])
-                    elif rhv[1] == ">=":
-                        statement = statement.where(
-                            getattr(table, lhv) >= rhv[1])
+                if _is_operator_clause(rhv):
+                    statement = statement.where(
+                        _OPERATORS[rhv[0]](getattr(table, lhv), rhv[1]))
                 else:
                     statement = statement.where(getattr(table, lhv) == rhv)  # noqa
         return statement
 
     @staticmethod
-    def order_by(statement: Select,
-                 clauses: Union[str, List[str]],
-                 table,
-                 ) -> Select:
-        """ Order the queried results based on clauses.
-        :params statement - The select query statement.
-        :params clauses - The columns' name used for ordering.
+    def order_keys(clauses: Union[str, List[str]],
+                   table,
+                   ) -> List[Tuple[str, bool]]:
+        """ Parse the ordering clauses.
+        :params clauses - The columns' name used for ordering, prefixed by '-' for descending.
         :params table - Specify the table class to be queried.
 
-        :return A new query statement
+        :return A list of (column name, is descending) pairs of existing columns.
         """
         if isinstance(clauses, str):
             clauses = [clauses]
 
-        query_clauses = []
+        keys = []
         for c in clauses:
             is_desc = False
             if c.startswith("-"):
@@ -253,6 +818,23 @@ class BaseDBO(Generic[_TT]):
             if not hasattr(table, c):
                 continue
 
+            keys.append((c, is_desc))
+        return keys
+
+    @staticmethod
+    def order_by(statement: Select,
+                 clauses: Union[str, List[str]],
+                 table,
+                 ) -> Select:
+        """ Order the queried results based on clauses.
+        :params statement - The select query statement.
+        :params clauses - The columns' name used for ordering.
+        :params table - Specify the table class to be queried.
+
+        :return A new query statement
+        """
+        query_clauses = []
+        for c, is_desc in StatementBuilder.order_keys(clauses, table):
             c = getattr(table, c)
             if is_desc:
                 c = c.desc()
@@ -264,6 +846,45 @@ class BaseDBO(Generic[_TT]):
 
         return statement
 
+    @staticmethod
+    def seek(statement: Select[_RT],
+             keys: List[Tuple[str, bool]],
+             table,
+             values: List[Any],
+             ) -> Select[_RT]:
+        """ Pick rows strictly after the given sort key (keyset pagination).
+        :params statement - The select query statement.
+        :params keys - The (column name, is descending) pairs the statement is ordered by.
+        :params table - Specify the table class to be queried.
+        :params values - The sort key values of the last row of previous page, None for NULL.
+
+        :return A new query statement
+        """
+        if len(keys) != len(values):
+            raise ValueError("The cursor does not match the ordering columns")
+
+        # (k1, k2, ...) > (v1, v2, ...) expanded as
+        # k1 > v1 OR (k1 = v1 AND k2 > v2) OR ..., with '<' for descending columns.
+        # NULLs sort first in ascending order on SQLite and MySQL, and last in descending order.
+        conditions = []
+        for i, (c, is_desc) in enumerate(keys):
+            col = getattr(table, c)
+            equals = [getattr(table, k).is_(None) if v is None else getattr(table, k) == v
+                      for (k, _), v in zip(keys[:i], values[:i])]
+            if values[i] is None:
+                if is_desc:
+                    # Nothing follows NULL
+                    continue
+                after = col.is_not(None)
+            elif is_desc:
+                after = col < values[i]
+                if table.__table__.columns[c].nullable:
+                    after = or_(after, col.is_(None))
+            else:
+                after = col > values[i]
+            conditions.append(and_(*equals, after))
+        return statement.where(or_(false(), *conditions))
+
     @staticmethod
     def page(statement: Select[_RT],
              page: int = 0,
@@ -280,3 +901,587 @@ class BaseDBO(Generic[_TT]):
             statement = statement.offset(
                 (page - 1) * page_size).limit(page_size)
         return statement
+
+
+class BaseDBO(StatementBuilder[_TT]):
+    _write_behind: Optional[WriteBehindBuffer] = None
+
+    def __init__(self, engine: Engine, create_table: bool = True) -> None:
+        """ :params create_table - Whether to create or migrate the table now, False if it
+                                   is done in one go for all tables (see DBManager._init_tables).
+        """
+        self._engine = engine
+        if create_table:
+            self.create_table()
+
+    def create_table(self) -> None:
+        """ Create the table and its indexes if they do not exist, along with the version
+        sequence and tombstones of versioned tables.
+        """
+        self._table.__table__.create(self._engine, checkfirst=True)
+        # Tables created before a column or unique key got declared miss it
+        self._add_missing_columns()
+        self._add_missing_unique_keys()
+        # Tables created before an index got declared miss it
+        for index in self._table.__table__.indexes:
+            index.create(self._engine, checkfirst=True)
+
+        if self.versioned:
+            TableVersion.__table__.create(self._engine, checkfirst=True)
+            TableTombstone.__table__.create(self._engine, checkfirst=True)
+            try:
+                with self._engine.begin() as conn:
+                    conn.execute(self._init_version_statement())
+            except IntegrityError:
+                # Started concurrently by another process
+                pass
+
+    def _add_missing_columns(self) -> None:
+        table = self._table.__table__
+        existing = {c["name"] for c in inspect(self._engine).get_columns(table.name)}
+        missing = [c for c in table.columns if c.name not in existing]
+        if not missing:
+            return
+
+        preparer = self._engine.dialect.identifier_preparer
+        with self._engine.begin() as conn:
+            for column in missing:
+                logger.info(f"* Add column '{column.name}' to table '{table.name}'")
+                ddl = CreateColumn(column).compile(dialect=self._engine.dialect)
+                conn.execute(text(f"ALTER TABLE {preparer.format_table(table)} ADD COLUMN {ddl}"))
+            if "row_version" in (c.name for c in missing):
+                # Existing rows get the first version, so that select_since(0) returns them
+                conn.execute(_update(table).values(row_version=1))
+
+    def _add_missing_unique_keys(self) -> None:
+        """ Create the unique constraints missing from the table as unique indexes, which
+        upserts can use as conflict keys the same way.
+
+        :raise ValueError if rows of the table already duplicate a key.
+        """
+        table = self._table.__table__
+        inspector = inspect(self._engine)
+        existing = {frozenset(c["column_names"]) for c in inspector.get_unique_constraints(table.name)}
+        existing |= {frozenset(i["column_names"]) for i in inspector.get_indexes(table.name) if i["unique"]}
+        existing |= {frozenset(c.name for c in table.primary_key.columns)}
+
+        preparer = self._engine.dialect.identifier_preparer
+        for constraint in table.constraints:
+            if not isinstance(constraint, UniqueConstraint):
+                continue
+            columns = list(constraint.columns)
+            if frozenset(c.name for c in columns) in existing:
+                continue
+            with self._engine.begin() as conn:
+                duplicate = conn.execute(
+                    _select(*columns, func.count()).group_by(*columns).having(func.count() > 1).limit(1)).first()
+                if duplicate is not None:
+                    raise ValueError(
+                        f"Can not add unique key ({', '.join(c.name for c in columns)}) to table "
+                        f"'{table.name}', {duplicate[-1]} rows share {tuple(duplicate[:-1])}. "
+                        f"Remove the duplicates and restart.")
+                logger.info(f"* Add unique key '{constraint.name}' to table '{table.name}'")
+                conn.execute(text(f"CREATE UNIQUE INDEX {preparer.quote(constraint.name)} "
+                                  f"ON {preparer.format_table(table)} "
+                                  f"({', '.join(preparer.quote(c.name) for c in columns)})"))
+
+    def _next_version(self, session: Session) -> Optional[int]:
+        """ Reserve the version stamped by a write, None if the table is not versioned.
+        The sequence row stays locked until the transaction ends, so versions get
+        committed in increasing order and change feeds never skip one.
+        """
+        if not self.versioned:
+            return None
+        bump, current = self._version_statements()
+        session.execute(bump)
+        return session.execute(current).scalar_one()
+
+    @property
+    def write_behind(self) -> Optional[WriteBehindBuffer]:
+        return self._write_behind
+
+    def enable_write_behind(self,
+                            max_pending: int = 10000,
+                            flush_size: int = 500,
+                            flush_interval: float = 0.5,
+                            ) -> WriteBehindBuffer:
+        """ Buffer updates and write them in batches from a background thread, eq. for
+        frequent status reports. See WriteBehindBuffer.
+        """
+        if self._write_behind is None:
+            self._write_behind = WriteBehindBuffer(self, max_pending, flush_size, flush_interval)
+        return self._write_behind
+
+    def enable_counters(self, *columns: str, install: bool = True) -> None:
+        """ Keep the row counts per value of the columns up to date by triggers, and
+        read count and count_by of a single column from them, eq. the number of models
+        per deploy_status without scanning the table.
+        :params install - Whether to (re)install the triggers and recompute the counts,
+                          False if the database already has them for these columns.
+        """
+        if install:
+            install_counters(self._engine, self._table, columns)
+        super().enable_counters(*columns)
+
+    def transaction(self):
+        """ Run all DBO calls on this engine within the context in a single transaction.
+        Usage:
+            with dbo.transaction():
+                dbo.insert(...)
+                dbo.update(...)
+        """
+        return transaction(self._engine)
+
+    @contextmanager
+    def _session(self, read: bool = False) -> Iterator[Session]:
+        """ Join the active transaction, or run in a new session committed on exit.
+        :params read - Whether the session only reads, so it may run on a replica.
+        """
+        tx = current_transaction(self._engine)
+        if tx is not None:
+            yield tx.session
+            return
+        engine = self._engine
+        if read and self._router is not None:
+            engine = self._router.read_engine(engine)
+        with Session(engine) as session, session.begin():
+            yield session
+
+    @retryable(idempotent=False)
+    def insert(self, **columns) -> None:
+        """ Insert a new record to the table. A soft-deleted row with the same unique key
+        is replaced, rather than failing until it gets purged.
+        :params kwargs - Key-value format parameters
+
+        :return None
+        """
+        # Filter out attributes are not belonging to the table.
+        for k in list(columns.keys()):
+            if not hasattr(self._table, k):
+                del columns[k]
+
+        with self._session() as session:
+            columns.update(self._stamps(self._next_version(session)))
+            replaced = self._replace_deleted([columns])
+            if replaced is not None:
+                session.execute(*replaced)
+            session.add(self._table(**columns))
+        self._invalidate_cache()
+
+    def insert_many(self,
+                    rows: Iterable[Dict[str, Any]],
+                    chunk_size: int = 1000,
+                    ) -> int:
+        """ Insert records to the table in batches.
+        Each chunk is sent as one executemany round-trip inside its own transaction,
+        so a failed chunk is retried alone and earlier chunks stay committed.
+        Soft-deleted rows with the same unique keys are replaced, see insert.
+        :params rows - Key-value format records
+        :params chunk_size - The number of rows per chunk (transaction)
+
+        :return The number of inserted rows.
+        """
+        if chunk_size <= 0:
+            raise ValueError(f"chunk_size must be positive, got {chunk_size}")
+
+        rows = iter(rows)
+        total = 0
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            total += self._insert_chunk(chunk)
+        return total
+
+    @retryable(idempotent=False)
+    def _insert_chunk(self, chunk: List[Dict[str, Any]]) -> int:
+        statement = self._insert_statement()
+        with self._session() as session:
+            stamps = self._stamps(self._next_version(session))
+            replaced = self._replace_deleted(chunk)
+            if replaced is not None:
+                session.execute(*replaced)
+            for params in self._insert_params(chunk, stamps):
+                session.execute(statement, params)
+        self._invalidate_cache()
+        return len(chunk)
+
+    def upsert(self,
+               rows: Iterable[Dict[str, Any]],
+               conflict_keys: Optional[List[str]] = None,
+               update_columns: Optional[List[str]] = None,
+               chunk_size: int = 1000,
+               ) -> int:
+        """ Insert records, or update the existing ones having the same unique keys.
+        Compiled to 'INSERT ... ON CONFLICT DO UPDATE' on SQLite and
+        'INSERT ... ON DUPLICATE KEY UPDATE' on MySQL, one transaction per chunk.
+        Note rows with NULL in conflict keys never conflict.
+        :params rows - Key-value format records, which must contain all conflict keys
+        :params conflict_keys - The columns of a unique constraint. None for the table's default.
+        :params update_columns - Columns updated on conflicts. None for all given columns.
+        :params chunk_size - The number of rows per chunk (transaction)
+
+        :return The number of upserted rows.
+        """
+        if chunk_size <= 0:
+            raise ValueError(f"chunk_size must be positive, got {chunk_size}")
+        conflict_keys, update_columns = self._upsert_keys(conflict_keys, update_columns)
+
+        rows = iter(rows)
+        total = 0
+        while True:
+            chunk = list(islice(rows, chunk_size))
+            if not chunk:
+                break
+            self._check_conflict_keys(chunk, conflict_keys)
+            total += self._upsert_chunk(chunk, conflict_keys, update_columns)
+        return total
+
+    @retryable()
+    def _upsert_chunk(self,
+                      chunk: List[Dict[str, Any]],
+                      conflict_keys: Tuple[str, ...],
+                      update_columns: Optional[Tuple[str, ...]],
+                      ) -> int:
+        dialect = self._engine.dialect.name
+        with self._session() as session:
+            stamps = self._stamps(self._next_version(session))
+            if self.soft_deletes:
+                stamps["deleted"] = False
+            for params in self._insert_params(chunk, stamps):
+                statement = self._upsert_statement(
+                    dialect, tuple(sorted(params[0])), conflict_keys, update_columns)
+                session.execute(statement, params)
+        self._invalidate_cache()
+        return len(chunk)
+
+    @retryable()
+    def delete(self,
+               where: Dict[str, Any] = {},
+               soft_deletion: bool = True,
+               ) -> bool:
+        """ Delete a record from the table.
+        Deletions from versioned tables are recorded as tombstones (see select_since).
+        :params where - The clauses for query
+        :params soft_deletion - Flag specifying conduct a soft-deletion or hard-deletion.
+                                Soft-deleted rows stay in the table until purged (see purge_deleted),
+                                or replaced by inserts of their unique keys (see insert).
+        """
+        if soft_deletion and not self.soft_deletes:
+            raise ValueError(f"Table '{self._table.__tablename__}' has no 'deleted' column for soft deletions")
+
+        with self._session() as session:
+            version = self._next_version(session)
+            if version is not None:
+                statement, params = self._deleted_rows_statement(where)
+                tombstones = self._tombstones(session.execute(statement, params).all(), version)
+                if tombstones:
+                    session.execute(_insert(TableTombstone), tombstones)
+
+            if soft_deletion:
+                statement, params = self._update_statement(
+                    {"deleted": True}, {"deleted": False, **where}, self._stamps(version))
+                session.execute(statement, params)
+            else:
+                statement, params = self._delete_statement(where)
+                session.execute(statement, params)
+        self._invalidate_cache()
+        if soft_deletion:
+            return True
+
+    def purge_deleted(self, older_than: float, batch_size: int = 1000) -> int:
+        """ Hard-delete the soft-deleted rows and the tombstones older than some days,
+        one transaction per batch so that locks stay short. Change feed consumers
+        lagging further behind miss these deletions (see select_since).
+        :params older_than - The number of days since the deletion.
+        :params batch_size - The number of rows deleted per transaction.
+
+        :return The number of purged rows and tombstones.
+        """
+        if batch_size <= 0:
+            raise ValueError(f"batch_size must be positive, got {batch_size}")
+        cutoff = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=older_than)
+
+        if not self.versioned:
+            raise ValueError(f"Table '{self._table.__tablename__}' is not versioned")
+        total = 0
+        # Soft-deleted rows are aged by their updated_at
+        for tombstones in ((False, True) if self.soft_deletes else (True,)):
+            while True:
+                purged = self._purge_batch(tombstones, cutoff, batch_size)
+                total += purged
+                if purged < batch_size:
+                    break
+        if total:
+            self._invalidate_cache()
+        return total
+
+    @retryable()
+    def _purge_batch(self, tombstones: bool, cutoff: datetime, batch_size: int) -> int:
+        select_ids, delete = self._purge_statements(tombstones)
+        with self._session() as session:
+            ids = session.execute(select_ids, {"cutoff": cutoff, "p_limit": batch_size}).scalars().all()
+            if ids:
+                session.execute(delete, {"ids": ids})
+        return len(ids)
+
+    @retryable()
+    def update(self,
+               fields: Dict[str, Any],
+               where: Dict[str, Any]
+               ) -> bool:
+        """ Update a record of the table.
+        :params fields - Columns to be updated.
+        :params where - Clauses for query.
+        """
+        with self._session() as session:
+            statement, params = self._update_statement(fields, where, self._stamps(self._next_version(session)))
+            session.execute(statement, params)
+        self._invalidate_cache()
+
+    @retryable()
+    def update_many(self, updates: Iterable[Tuple[Dict[str, Any], Dict[str, Any]]]) -> int:
+        """ Update rows matched by their keys in one transaction, with one executemany
+        per combination of key and field columns.
+        :params updates - (key, fields) pairs, where the key holds the values of the
+                          primary or a unique key, eq. {"id": 1} or
+                          {"model_id": "m", "model_version": "1"}.
+
+        :return The number of updates executed.
+        """
+        groups = self._update_many_params(updates)
+        if not groups:
+            return 0
+
+        with self._session() as session:
+            stamps = self._stamps(self._next_version(session))
+            conn = session.connection()
+            for (key_columns, fields), params in groups.items():
+                for p in params:
+                    p.update((f"v_{k}", v) for k, v in stamps.items())
+                conn.execute(self._update_many_statement(key_columns, fields + tuple(stamps)), params)
+        self._invalidate_cache()
+        return sum(len(params) for params in groups.values())
+
+    @retryable()
+    def count(self, filter_by: Dict[str, Any] = {}) -> int:
+        """ Count the number of rows that meets the condition in the table.
+        :params filter_by - The clauses for query (See StatementBuilder.where)
+        :return The number of rows in the table.
+        """
+        entry, result = self._cache_lookup("count", filter_by)
+        if result is not MISSING:
+            return result
+
+        statement, params = self._count_statement(filter_by)
+
+        with self._session(read=True) as session:
+            result = session.execute(statement, params).scalar()
+
+        return self._cache_store(entry, result)
+
+    @retryable()
+    def count_by(self, *columns: str, where: Dict[str, Any] = {}) -> Dict[Any, int]:
+        """ Count the rows of each group of values of the columns, in one GROUP BY query.
+        Counting by a single counted column without filters reads the counters instead
+        (see enable_counters).
+        :params columns - The columns to group by.
+        :params where - The clauses for query (See StatementBuilder.where)
+
+        :return {value: count} for one column, {(value1, value2, ...): count} for several.
+                Groups without rows are left out.
+        """
+        entry, result = self._cache_lookup("count_by", columns, where)
+        if result is not MISSING:
+            return result
+
+        statement, params = self._count_by_statement(columns, where)
+
+        with self._session(read=True) as session:
+            result = self._count_by_result(session.execute(statement, params).all(), columns)
+
+        return self._cache_store(entry, result)
+
+    @retryable()
+    def select(self,
+               *columns: Optional[List[str]],
+               where: Dict[str, Any] = {},
+               order_by: Optional[Union[str, List[str]]] = None,
+               paging: Optional[Tuple[int, int]] = None,
+               after: Optional[str] = None,
+               limit: Optional[int] = None,
+               result_format: str = "dicts",
+               ) -> Any:
+        """ Query a table and return rows meet the condition.
+        :params columns - Specify wanted columns. None for all columns (eq. SELECT *)
+        :params where - Specify the where clauses (See StatementBuilder.where)
+        :params order_by - Specify the column(s) by which results will get ordered. None for no ordering.
+        :params paging - Specify the paging info for picking part of rows of the table
+        :params after - The cursor returned by the previous keyset page. None for the first page.
+        :params limit - Enable keyset pagination and specify the number of rows per page.
+        :params result_format - 'dicts', 'tuples', 'records' or 'columns' (See _SelectPlan.format)
+
+        :return A list of queried values. In keyset pagination mode (limit is given),
+                a tuple of the list and the cursor of next page (None for the last page).
+        """
+        entry, result = self._cache_lookup("select", columns, where, order_by, paging, after, limit, result_format)
+        if result is not MISSING:
+            return result
+
+        plan = self._select_plan(columns, where, order_by, paging, after, limit)
+
+        # Execute the SQL
+        with self._session(read=True) as session:
+            rows = session.execute(plan.statement, plan.params).all()
+        self._record_rows(len(rows))
+        result = plan.result(rows, result_format)
+
+        return self._cache_store(entry, result)
+
+    def get_many(self,
+                 column: str,
+                 values: Iterable[Any],
+                 *columns: Optional[List[str]],
+                 chunk_size: int = 500,
+                 ) -> List[Dict[str, Any]]:
+        """ Query rows whose column matches any of the values, in a few IN (...) queries.
+        :params column - The column to be matched.
+        :params values - The wanted values. Duplicates are queried once.
+        :params columns - Specify wanted columns. None for all columns (eq. SELECT *)
+        :params chunk_size - The number of values per query, which must stay under the
+                             bind parameter limit of the driver (999 for old SQLite).
+
+        :return A list of queried values.
+        """
+        if chunk_size <= 0:
+            raise ValueError(f"chunk_size must be positive, got {chunk_size}")
+        if not hasattr(self._table, column):
+            raise ValueError(f"Unknown column '{column}' of table '{self._table.__tablename__}'")
+
+        values = list(dict.fromkeys(values))
+        result = []
+        for i in range(0, len(values), chunk_size):
+            result += self.select(*columns, where={column: ["in", values[i:i + chunk_size]]})
+        return result
+
+    def iter_select(self,
+                    *columns: Optional[List[str]],
+                    where: Dict[str, Any] = {},
+                    order_by: Optional[Union[str, List[str]]] = None,
+                    batch_size: int = 1000,
+                    result_format: str = "dicts",
+                    ) -> Iterator[Any]:
+        """ Query a table and stream rows meet the condition.
+        Rows are fetched through a server-side cursor in batches of batch_size, so the
+        memory usage is bounded regardless of the table size. The session is released
+        once the iterator is exhausted or closed (eq. the consumer breaks early).
+        Unlike select, failures while iterating are not retried.
+        :params columns - Specify wanted columns. None for all columns (eq. SELECT *)
+        :params where - Specify the where clauses (See StatementBuilder.where)
+        :params order_by - Specify the column(s) by which results will get ordered. None for no ordering.
+        :params batch_size - The number of rows fetched per round-trip.
+        :params result_format - 'dicts', 'tuples' or 'records' (See _SelectPlan.format) for
+                                one row per item, 'columns' for a dict of columns per batch.
+
+        :return An iterator of queried values.
+        """
+        if batch_size <= 0:
+            raise ValueError(f"batch_size must be positive, got {batch_size}")
+
+        if result_format not in _RESULT_FORMATS:
+            raise ValueError(f"Unknown result format '{result_format}', expect one of {_RESULT_FORMATS}")
+
+        # Built here rather than in the generator, so that invalid arguments raise on the call
+        plan = self._select_plan(columns, where, order_by)
+        return self._iter_plan(plan, batch_size, result_format)
+
+    def _iter_plan(self, plan: _SelectPlan, batch_size: int, result_format: str) -> Iterator[Any]:
+        """ Stream the rows of a select plan, see iter_select. """
+        with self._session(read=True) as session:
+            result = session.execute(plan.statement, plan.params,
+                                     execution_options={"yield_per": batch_size})
+            try:
+                for partition in result.partitions():
+                    self._record_rows(len(partition))
+                    if result_format == "columns":
+                        yield plan.format(partition, result_format)
+                    else:
+                        yield from plan.format(partition, result_format)
+            finally:
+                result.close()
+
+    def select_since(self,
+                     version: int = 0,
+                     limit: Optional[int] = None,
+                     page_size: int = 1000,
+                     ) -> Iterator[Dict[str, Any]]:
+        """ Stream the changes of a versioned table after a version, in version order,
+        so that consumers sync incrementally: pass the row_version of the last change
+        processed to get the next ones, 0 for all rows.
+        Live rows come as dicts of their default columns, id, row_version and updated_at
+        with 'deleted' False. Deleted rows come as tombstones of their id, unique keys,
+        row_version and updated_at (the deletion time) with 'deleted' True. A row changed
+        several times only comes once, at its last version. Writes through execute are
+        not stamped, so they are missed.
+        :params version - The version of the last change already processed.
+        :params limit - Stop after limit changes, then finish the changes of the last
+                        version, so that its row_version is a safe checkpoint. None for all.
+        :params page_size - The number of rows fetched per query.
+
+        :return An iterator of changes.
+        """
+        if not self.versioned:
+            raise ValueError(f"Table '{self._table.__tablename__}' is not versioned")
+        if page_size <= 0:
+            raise ValueError(f"page_size must be positive, got {page_size}")
+
+        changes = heapq.merge(self._iter_changes(version, page_size, deleted=False),
+                              self._iter_changes(version, page_size, deleted=True),
+                              key=lambda change: change["row_version"])
+        count, last = 0, None
+        for change in changes:
+            if limit is not None and count >= limit and change["row_version"] != last:
+                return
+            yield change
+            count += 1
+            last = change["row_version"]
+
+    def _iter_changes(self, version: int, page_size: int, deleted: bool) -> Iterator[Dict[str, Any]]:
+        """ Page through the changed rows, or the tombstones, after a version. """
+        params = {"version": version, "p_limit": page_size}
+        after = False
+        while True:
+            statement = self._changes_statements(after)[deleted]
+            with self._session(read=True) as session:
+                rows = session.execute(statement, params).all()
+            self._record_rows(len(rows))
+
+            for row in rows:
+                if deleted:
+                    yield {"id": row.row_id, **json.loads(row.row_key), "row_version": row.version,
+                           "updated_at": row.deleted_at, "deleted": True}
+                else:
+                    yield {**row._mapping, "deleted": False}
+            if len(rows) < page_size:
+                return
+            last = rows[-1]
+            params["version"], params["id"] = last.version if deleted else last.row_version, last.id
+            after = True
+
+    @retryable(idempotent=False)
+    def execute(self,
+                statement: Union[Select[_RT], Update, Delete],
+                ) -> Union[None, List[_RT]]:
+        is_select = False
+
+        if isinstance(statement, (Select,)):
+            is_select = True
+
+        result = None
+        with self._session(read=is_select) as session:
+            rows = session.execute(statement)
+            if is_select:
+                result = rows.all()
+        if not is_select:
+            self._invalidate_cache()
+        return result
@@ -0,0 +1,421 @@
+# Benchmarks of the dbo layer.
+#
+# Usage:
+#   python benchmark.py
+#       Micro benchmarks of the statement cache, result formats and SQLite profile.
+#   python benchmark.py benchmark.suite=true [benchmark.sizes=[1000,10000]] [benchmark.ops=500]
+#                       [benchmark.output=result.json] [benchmark.baseline=baseline.json]
+#                       [benchmark.tolerance=0.2]
+#       The workload suite on a temporary SQLite database, see bench_suite. Options are
+#       read by Configuration, so any 'database.local.*' setting can be overridden as well.
+#       Exits with status 1 if the result regresses from the baseline beyond the tolerance.
+#   python benchmark.py benchmark.startup=true
+#       Startup time of DBManager on a fresh and on an initialized database, see bench_startup.
+__all__ = [
+    "bench_statement_cache",
+    "bench_result_formats",
+    "bench_sqlite_profile",
+    "bench_suite",
+    "bench_startup",
+    "compare_with_baseline",
+]
+
+import json
+import os
+import random
+import sys
+import tempfile
+import threading
+import time
+from typing import Any, Callable, Dict, List
+
+from sqlalchemy import create_engine, select
+from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
+
+from config import Configuration
+from dbo import ModelDBO
+from manager import DBManager
+from models import Table
+
+
+def _time_per_call(fn: Callable[[], None], n: int) -> float:
+    fn()  # Warm up
+    start = time.perf_counter()
+    for _ in range(n):
+        fn()
+    return (time.perf_counter() - start) / n
+
+
+def bench_statement_cache(rows: int = 10000, n: int = 2000) -> Dict[str, Dict[str, float]]:
+    """ Per-call latency (us) of small point lookups with and without the statement cache.
+    """
+    dbo = ModelDBO(create_engine("sqlite://"))
+    dbo.insert_many({"model_id": str(i), "deploy_status": str(i % 5)} for i in range(rows))
+    # Look up by primary key, so that the timing is not dominated by a table scan
+    where_id = {"id": rows // 2}
+
+    calls = {
+        "select": lambda: dbo.select(where=where_id),
+        "select_columns": lambda: dbo.select("model_id", "deploy_status", where=where_id),
+        "count": lambda: dbo.count({"id": rows // 2}),
+        "update": lambda: dbo.update({"deploy_status": "0"}, where_id),
+    }
+
+    report = {}
+    for name, fn in calls.items():
+        dbo.use_statement_cache = False
+        uncached = _time_per_call(fn, n)
+        dbo.use_statement_cache = True
+        cached = _time_per_call(fn, n)
+        report[name] = {
+            "uncached_us": uncached * 1e6,
+            "cached_us": cached * 1e6,
+            "saving_us": (uncached - cached) * 1e6,
+        }
+    return report
+
+
+def bench_result_formats(rows: int = 100000, n: int = 3) -> Dict[str, float]:
+    """ Latency (ms) of reading the whole table in each result format, compared with
+    hydrating ORM instances and converting them by to_dict.
+    """
+    dbo = ModelDBO(create_engine("sqlite://"))
+    dbo.insert_many({"model_id": str(i), "model_version": "1", "deploy_status": str(i % 5)}
+                    for i in range(rows))
+
+    def orm_to_dict():
+        with Session(dbo._engine) as session:
+            return [r.to_dict() for r in session.scalars(select(Table))]
+
+    calls = {"orm_to_dict": orm_to_dict}
+    for result_format in ("dicts", "tuples", "records", "columns"):
+        calls[result_format] = lambda f=result_format: dbo.select(result_format=f)
+
+    return {name: _time_per_call(fn, n) * 1e3 for name, fn in calls.items()}
+
+
+# The tuned profile of config.yaml, 'database.local'
+SQLITE_TUNED_PRAGMAS = {
+    "journal_mode": "wal",
+    "synchronous": "normal",
+    "busy_timeout": 5000,
+    "cache_size": -65536,
+    "mmap_size": 268435456,
+    "temp_store": "memory",
+}
+
+
+def bench_sqlite_profile(writers: int = 4,
+                         readers: int = 4,
+                         seconds: float = 3,
+                         rows: int = 10000,
+                         ) -> Dict[str, Dict[str, Any]]:
+    """ Throughput (ops/s) of concurrent single-row writers and point-lookup readers on a
+    SQLite file, with the default settings and with the tuned PRAGMA profile.
+    """
+    report = {}
+    for profile, pragmas in (("default", {}), ("tuned", SQLITE_TUNED_PRAGMAS)):
+        with tempfile.TemporaryDirectory() as tmp:
+            url = "sqlite:///{}?check_same_thread=False".format(os.path.join(tmp, "bench.db"))
+            kwargs = {}
+            if pragmas:
+                kwargs = dict(poolclass=QueuePool, pool_size=writers + readers)
+            engine = create_engine(url, isolation_level=None, **kwargs)
+            DBManager.set_sqlite_pragmas(engine, pragmas)
+
+            dbo = ModelDBO(engine)
+            dbo.insert_many({"model_id": str(i), "model_version": "1"} for i in range(rows))
+
+            counts = {"write": 0, "read": 0}
+            lock = threading.Lock()
+            deadline = time.monotonic() + seconds
+
+            def worker(kind: str, seed: int):
+                i, done = seed, 0
+                while time.monotonic() < deadline:
+                    try:
+                        if kind == "write":
+                            dbo.insert(model_id=f"w{seed}-{i}", model_version="1")
+                        else:
+                            dbo.select(where={"id": i % rows + 1})
+                        done += 1
+                    except Exception:
+                        pass
+                    i += 1
+                with lock:
+                    counts[kind] += done
+
+            threads = [threading.Thread(target=worker, args=("write", n)) for n in range(writers)]
+            threads += [threading.Thread(target=worker, args=("read", n)) for n in range(readers)]
+            for t in threads:
+                t.start()
+            for t in threads:
+                t.join()
+            engine.dispose()
+
+        report[profile] = {
+            "writes_per_s": counts["write"] / seconds,
+            "reads_per_s": counts["read"] / seconds,
+        }
+    return report
+
+
+
+def _latency_stats(latencies: List[float], seconds: float) -> Dict[str, float]:
+    latencies = sorted(latencies)
+    n = len(latencies)
+    return {
+        "ops": n,
+        "ops_per_s": n / seconds if seconds else 0.0,
+        "p50_ms": latencies[n // 2] * 1e3 if n else 0.0,
+        "p99_ms": latencies[min(n - 1, int(n * 0.99))] * 1e3 if n else 0.0,
+    }
+
+
+def _measure(fn: Callable[[int], Any], n: int) -> Dict[str, float]:
+    """ Call fn(i) for i in range(n), timing each call. """
+    fn(-1)  # Warm up
+    latencies = []
+    start = time.perf_counter()
+    for i in range(n):
+        t = time.perf_counter()
+        fn(i)
+        latencies.append(time.perf_counter() - t)
+    return _latency_stats(latencies, time.perf_counter() - start)
+
+
+def _measure_mixed(dbo: ModelDBO,
+                   size: int,
+                   writers: int,
+                   readers: int,
+                   seconds: float,
+                   ) -> Dict[str, Any]:
+    """ Concurrent single-row writers and point-lookup readers for some seconds. """
+    latencies = {"write": [], "read": []}
+    errors = {"write": 0, "read": 0}
+    lock = threading.Lock()
+    deadline = time.monotonic() + seconds
+
+    def worker(kind: str, seed: int):
+        rnd = random.Random(seed)
+        done, failed, i = [], 0, 0
+        while time.monotonic() < deadline:
+            t = time.perf_counter()
+            try:
+                if kind == "write":
+                    dbo.insert(model_id=f"mixed-{kind}{seed}-{i}", model_version="1")
+                else:
+                    dbo.select(where={"id": rnd.randint(1, size)})
+                done.append(time.perf_counter() - t)
+            except Exception:
+                failed += 1
+            i += 1
+        with lock:
+            latencies[kind] += done
+            errors[kind] += failed
+
+    threads = [threading.Thread(target=worker, args=("write", n)) for n in range(writers)]
+    threads += [threading.Thread(target=worker, args=("read", writers + n)) for n in range(readers)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+    report = {kind: _latency_stats(latencies[kind], seconds) for kind in latencies}
+    for kind in errors:
+        report[kind]["errors"] = errors[kind]
+    report["ops_per_s"] = report["write"]["ops_per_s"] + report["read"]["ops_per_s"]
+    return report
+
+
+def _bench_size(dbo: ModelDBO,
+                size: int,
+                ops: int,
+                bulk_rows: int,
+                page_size: int,
+                mixed_seconds: float,
+                ) -> Dict[str, Any]:
+    """ Run every workload on a table loaded with size rows. """
+    dbo.insert_many(({"model_id": str(i), "model_version": "1", "deploy_status": str(i % 5)}
+                     for i in range(size)), chunk_size=10000)
+    rnd = random.Random(size)
+    ops = min(ops, size)
+    # Rows to delete, distinct and out of the ranges touched by the other workloads
+    deleted = rnd.sample(range(size // 2 + 1, size + 1), ops + 1)
+    pages = max(1, size // page_size)
+
+    def select_range(lo: int):
+        return dbo.select(where={"id": ["between", [lo, lo + page_size - 1]]})
+
+    workloads = {
+        "insert_single": lambda i: dbo.insert(model_id=f"single-{i}", model_version="1"),
+        "insert_bulk": lambda i: dbo.insert_many(
+            {"model_id": f"bulk-{i}-{j}", "model_version": "1"} for j in range(bulk_rows)),
+        "select_eq": lambda i: dbo.select(where={"model_id": str(rnd.randrange(size))}),
+        "select_range": lambda i: select_range(rnd.randint(1, size // 2)),
+        "select_page_shallow": lambda i: dbo.select(paging=(1 + i % 10, page_size)),
+        "select_page_deep": lambda i: dbo.select(paging=(max(1, pages - i % 10), page_size)),
+        "count": lambda i: dbo.count({"deploy_status": str(i % 5)}),
+        "update": lambda i: dbo.update({"test_status": str(i)}, {"id": rnd.randint(1, size // 2)}),
+        "delete": lambda i: dbo.delete({"id": deleted[i]}, soft_deletion=False),
+    }
+    report = {}
+    for name, fn in workloads.items():
+        n = max(1, ops // 10) if name == "insert_bulk" else ops
+        report[name] = _measure(fn, n)
+        if name == "insert_bulk":
+            report[name]["rows_per_s"] = report[name]["ops_per_s"] * bulk_rows
+    report["mixed"] = _measure_mixed(dbo, size, writers=4, readers=4, seconds=mixed_seconds)
+    return report
+
+
+def bench_suite(sizes: List[int] = (1000, 10000, 100000, 1000000),
+                ops: int = 500,
+                bulk_rows: int = 1000,
+                page_size: int = 50,
+                mixed_seconds: float = 2,
+                ) -> Dict[str, Any]:
+    """ Throughput (ops/s) and p50/p99 latency (ms) of each workload against a temporary
+    SQLite database built by DBManager.init_local_engine, so with the 'database.local'
+    PRAGMA profile, at each table size.
+
+    :return {"sizes": {size: {workload: {"ops", "ops_per_s", "p50_ms", "p99_ms"}}}}
+    """
+    if Configuration._config is None:
+        Configuration.init_config()
+    config = Configuration.get_config()
+    local_path = config.get("database.local.path")
+
+    report = {}
+    try:
+        for size in sizes:
+            with tempfile.TemporaryDirectory() as tmp:
+                Configuration.set("database.local.path", os.path.join(tmp, "bench.db"))
+                engine = DBManager.init_local_engine()
+                try:
+                    report[str(size)] = _bench_size(
+                        ModelDBO(engine), size, ops, bulk_rows, page_size, mixed_seconds)
+                finally:
+                    engine.dispose()
+    finally:
+        Configuration.set("database.local.path", local_path)
+    return {"sizes": report}
+
+
+def bench_startup(runs: int = 5) -> Dict[str, float]:
+    """ Time (ms) from DBManager.init() to the first query on a temporary SQLite database:
+    "cold" on a fresh database, "warm" on one with the schema stamped by an earlier start,
+    and "eager" for binding the DBO by creating its tables on each start regardless.
+    """
+    if Configuration._config is None:
+        Configuration.init_config()
+    config = Configuration.get_config()
+    local_path = config.get("database.local.path")
+
+    def start(eager: bool) -> float:
+        begin = time.perf_counter()
+        DBManager.init()
+        if eager:
+            ModelDBO(DBManager._engine).count()
+        else:
+            DBManager.model.count()
+        elapsed = (time.perf_counter() - begin) * 1e3
+        DBManager.dispose()
+        return elapsed
+
+    timings = {"cold": [], "warm": [], "eager": []}
+    try:
+        for _ in range(runs):
+            with tempfile.TemporaryDirectory() as tmp:
+                Configuration.set("database.local.path", os.path.join(tmp, "bench.db"))
+                timings["cold"].append(start(eager=False))
+                timings["warm"].append(start(eager=False))
+                timings["eager"].append(start(eager=True))
+    finally:
+        Configuration.set("database.local.path", local_path)
+    return {name: sorted(ms)[len(ms) // 2] for name, ms in timings.items()}
+
+
+# Metrics compared with the baseline, and whether a higher value is better
+_BASELINE_METRICS = {"ops_per_s": True, "p99_ms": False}
+
+
+def compare_with_baseline(result: Dict[str, Any],
+                          baseline: Dict[str, Any],
+                          tolerance: float = 0.2,
+                          ) -> List[str]:
+    """ Compare a bench_suite result with a stored one, only the sizes and workloads
+    present in both.
+    :params tolerance - The relative change allowed, eq. 0.2 fails a drop of throughput
+                        over 20% or a rise of p99 latency over 20%.
+
+    :return Descriptions of the regressions, empty if none.
+    """
+    regressions = []
+    for size, workloads in result["sizes"].items():
+        for name, stats in workloads.items():
+            base = baseline.get("sizes", {}).get(size, {}).get(name)
+            if base is None:
+                continue
+            for metric, higher_is_better in _BASELINE_METRICS.items():
+                current, expected = stats.get(metric), base.get(metric)
+                # A drop to 0 is a regression, only metrics missing or without a baseline are not
+                if current is None or not expected:
+                    continue
+                change = (current - expected) / expected
+                if (-change if higher_is_better else change) > tolerance:
+                    regressions.append(f"{name} at {size} rows: {metric} {expected:.3f} -> "
+                                       f"{current:.3f} ({change:+.0%})")
+            current, expected = _errors(stats), _errors(base)
+            if current > expected:
+                regressions.append(f"{name} at {size} rows: errors {expected} -> {current}")
+    return regressions
+
+
+def _errors(stats: Dict[str, Any]) -> int:
+    """ The failed operations of a workload, eq. of the writers and readers of 'mixed'. """
+    return stats.get("errors", 0) + sum(v.get("errors", 0) for v in stats.values() if isinstance(v, dict))
+
+
+def _run_suite() -> int:
+    config = Configuration.get_config()
+    sizes = config.get("benchmark.sizes", default=[1000, 10000, 100000, 1000000])
+    result = bench_suite(sizes=[int(s) for s in sizes],
+                         ops=config.get("benchmark.ops", default=500, type=int),
+                         mixed_seconds=config.get("benchmark.mixed_seconds", default=2, type=float))
+
+    output = config.get("benchmark.output")
+    if output:
+        with open(output, "w") as f:
+            json.dump(result, f, indent=2)
+    else:
+        print(json.dumps(result, indent=2))
+
+    baseline = config.get("benchmark.baseline")
+    if not baseline or not os.path.exists(baseline):
+        return 0
+    with open(baseline) as f:
+        regressions = compare_with_baseline(
+            result, json.load(f), tolerance=config.get("benchmark.tolerance", default=0.2, type=float))
+    for r in regressions:
+        print(f"Regression: {r}", file=sys.stderr)
+    return 1 if regressions else 0
+
+
+if __name__ == "__main__":
+    Configuration.init_config()
+    if Configuration.get_config().get("benchmark.suite", default=False):
+        sys.exit(_run_suite())
+    if Configuration.get_config().get("benchmark.startup", default=False):
+        for name, ms in bench_startup().items():
+            print(f"{name:16s} {ms:8.1f}ms")
+        sys.exit(0)
+
+    for name, r in bench_statement_cache().items():
+        print(f"{name:16s} uncached {r['uncached_us']:8.1f}us  cached {r['cached_us']:8.1f}us  "
+              f"saving {r['saving_us']:7.1f}us")
+    for name, ms in bench_result_formats().items():
+        print(f"{name:16s} {ms:8.1f}ms")
+    for name, r in bench_sqlite_profile().items():
+        print(f"{name:16s} writes {r['writes_per_s']:8.1f}/s  reads {r['reads_per_s']:8.1f}/s")
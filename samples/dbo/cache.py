@@ -0,0 +1,156 @@
+__all__ = [
+    "MISSING",
+    "QueryCache",
+    "get_table_cache",
+    "invalidate_table_cache",
+]
+
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+MISSING = object()
+
+
+def freeze(value: Any) -> Hashable:
+    """ Normalize a (possibly nested) query argument into a hashable key part.
+    """
+    if isinstance(value, dict):
+        return tuple(sorted((k, freeze(v)) for k, v in value.items()))
+    if isinstance(value, (list, tuple)):
+        return tuple(freeze(v) for v in value)
+    if isinstance(value, set):
+        return tuple(sorted(freeze(v) for v in value))
+    return value
+
+
+def _copy_result(value: Any) -> Any:
+    # Callers own the returned rows, so never hand out the cached dicts themselves.
+    if isinstance(value, list):
+        return [dict(r) if isinstance(r, dict) else r for r in value]
+    if isinstance(value, tuple) and not hasattr(value, "_fields"):
+        return tuple(_copy_result(v) for v in value)
+    if isinstance(value, dict):
+        # Columnar results, of lists or NumPy arrays
+        return {k: v.copy() if hasattr(v, "copy") else v for k, v in value.items()}
+    return value
+
+
+class QueryCache(object):
+    """ A thread-safe LRU cache with TTL expiration for query results of one table.
+
+    Writes bump a generation counter, and results computed under an older
+    generation are dropped, so a query racing with a write never caches stale rows.
+    """
+
+    def __init__(self, max_entries: int = 1024, ttl: float = 60) -> None:
+        if max_entries <= 0:
+            raise ValueError(f"max_entries must be positive, got {max_entries}")
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self._entries: "OrderedDict[Hashable, Tuple[float, Any]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._generation = 0
+
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.invalidations = 0
+
+    def _after_fork(self) -> None:
+        # The lock may have been held by another thread
+        self._lock = threading.Lock()
+
+    @property
+    def generation(self) -> int:
+        return self._generation
+
+    def get(self, key: Hashable, default: Any = None) -> Any:
+        with self._lock:
+            entry = self._entries.get(key, MISSING)
+            if entry is not MISSING:
+                expires_at, value = entry
+                if expires_at > time.monotonic():
+                    self._entries.move_to_end(key)
+                    self.hits += 1
+                    return _copy_result(value)
+                del self._entries[key]
+            self.misses += 1
+            return default
+
+    def put(self, key: Hashable, value: Any, generation: int) -> None:
+        """ Store a result computed while the cache was at the given generation.
+        """
+        with self._lock:
+            if generation != self._generation:
+                return
+            self._entries[key] = (time.monotonic() + self.ttl, _copy_result(value))
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def invalidate(self) -> None:
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+            self.invalidations += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "size": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "invalidations": self.invalidations,
+            }
+
+
+# Caches are shared by database and table name, so that a write through any DBO of a
+# table (e.g. the sync and async ones) invalidates the cached reads of all of them.
+_table_caches: Dict[Tuple[Hashable, str], QueryCache] = {}
+_table_caches_lock = threading.Lock()
+
+
+def _database(engine) -> Hashable:
+    """ Identify the database of a (sync or async) engine. """
+    url = engine.url
+    if url.get_backend_name() == "sqlite" and url.database in (None, "", ":memory:"):
+        # Each in-memory database belongs to its engine
+        return id(engine)
+    return url.get_backend_name(), url.host, url.port, url.database
+
+
+def get_table_cache(engine,
+                    table_name: str,
+                    max_entries: int = 1024,
+                    ttl: float = 60,
+                    ) -> QueryCache:
+    key = (_database(engine), table_name)
+    with _table_caches_lock:
+        cache = _table_caches.get(key)
+        if cache is None:
+            cache = _table_caches[key] = QueryCache(max_entries, ttl)
+        return cache
+
+
+def invalidate_table_cache(engine, table_name: str) -> Optional[QueryCache]:
+    cache = _table_caches.get((_database(engine), table_name))
+    if cache is not None:
+        cache.invalidate()
+    return cache
+
+
+def _after_fork() -> None:
+    # The locks may have been held by other threads
+    global _table_caches_lock
+    _table_caches_lock = threading.Lock()
+    for cache in _table_caches.values():
+        cache._after_fork()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_after_fork)
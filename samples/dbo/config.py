@@ -6,11 +6,13 @@ __all__ = [
 
 import glob
 import os
+import threading
 import warnings
+from types import MappingProxyType
 
 from omegaconf import OmegaConf, DictConfig, ListConfig
 from tenacity import retry, stop_after_attempt
-from typing import Any, List, Optional, Union, Callable
+from typing import Any, Dict, List, Mapping, Optional, Set, Tuple, Union, Callable
 
 
 
@@ -21,6 +23,9 @@ _DEFAULT_CONFIG_FILE = os.path.join(_PROJECT_ROOT, _DEFAULT_CONFIG_FILE_NAME)
 # See: https://omegaconf.readthedocs.io/en/latest/usage.html#from-command-line-arguments
 _DISABLE_CLI_CONFIG = os.environ.get(
     "CONFIG_DISABLE_CLI", "false").lower() in ("true", "1")
+# Print the whole config on init, rather than a one-line summary
+_PRINT_CONFIG = os.environ.get(
+    "CONFIG_PRINT", "false").lower() in ("true", "1")
 
 class ConfigError(Exception):
     ...
@@ -46,10 +51,80 @@ def _read_cli_config() -> DictConfig:
     return config
 
 
+# Typed values cached by Configuration.get, only immutable ones so callers can't alter them
+_CACHEABLE_TYPES = (bool, int, float, str, bytes)
+
+
+def _flatten_config(node: Union[DictConfig, ListConfig],
+                    prefix: str,
+                    index: Dict[str, Any],
+                    unresolved: Set[str],
+                    ) -> None:
+    """ Index every node by its full dotted key (list indices included), with
+    interpolations resolved. Missing ('???') values are left out, as well as the ones
+    failing to resolve, whose keys are collected in unresolved.
+    """
+    keys = node.keys() if isinstance(node, DictConfig) else range(len(node))
+    for k in keys:
+        key = f"{prefix}{k}"
+        if OmegaConf.is_missing(node, k):
+            continue
+        try:
+            value = node[k]
+        except Exception:
+            unresolved.add(key)
+            continue
+        index[key] = value
+        if isinstance(value, (DictConfig, ListConfig)):
+            _flatten_config(value, key + ".", index, unresolved)
+
+
+class _Snapshot(object):
+    """ The merged config with its flattened index, swapped as a whole on reloads so
+    that readers never see a half-updated config.
+    """
+
+    def __init__(self, config: DictConfig, files: List[str]) -> None:
+        self.config = config
+        # The files and include directories the config was read from
+        self.files = files
+        index, unresolved = {}, set()
+        _flatten_config(config, "", index, unresolved)
+        self.index: Mapping[str, Any] = MappingProxyType(index)
+        self.unresolved = unresolved
+        # (key, type) -> converted value, see Configuration.get
+        self.typed: Dict[Tuple[str, Any], Any] = {}
+
+    def leaves(self) -> Dict[str, Any]:
+        return {k: v for k, v in self.index.items() if not isinstance(v, (DictConfig, ListConfig))}
+
+
+_EMPTY_SNAPSHOT = _Snapshot(OmegaConf.create({}), [])
+
+
+def _changed_keys(old: _Snapshot, new: _Snapshot) -> Set[str]:
+    old_leaves, new_leaves = old.leaves(), new.leaves()
+    missing = object()
+    return {k for k in old_leaves.keys() | new_leaves.keys()
+            if old_leaves.get(k, missing) != new_leaves.get(k, missing)}
+
+
 class Configuration:
     PROJ_ROOT_DIR = _PROJECT_ROOT
 
     _config: DictConfig = None
+    _snapshot: _Snapshot = _EMPTY_SNAPSHOT
+
+    # For reloads, the arguments of init_config
+    _yaml_file: Optional[str] = None
+    _cli_config: Optional[DictConfig] = None
+    # Values overridden by set, kept over reloads
+    _overrides: DictConfig = OmegaConf.create({})
+    _reload_lock = threading.Lock()
+    # (callback, key prefix) pairs, replaced rather than mutated so readers need no lock
+    _subscribers: Tuple[Tuple[Callable[[Set[str]], None], str], ...] = ()
+    _watcher: Optional[Tuple[threading.Thread, threading.Event]] = None
+    _watch_interval: Optional[float] = None
 
     def __init__(self) -> None:
         if self._config is None:
@@ -82,9 +157,38 @@ class Configuration:
         if not key:
             return default
 
+        snapshot = self._snapshot
+        try:
+            conf = snapshot.index[key]
+        except KeyError:
+            if key in snapshot.unresolved:
+                # Raise the resolution error
+                return self._get_node(snapshot.config, key, default, type)
+            conf = default
+        else:
+            if type is not None and conf is not None:
+                cache_key = (key, type)
+                try:
+                    return snapshot.typed[cache_key]
+                except KeyError:
+                    pass
+                value = type(conf)
+                if isinstance(value, _CACHEABLE_TYPES):
+                    snapshot.typed[cache_key] = value
+                return value
+
+        if type is not None and conf is not None:
+            # Not handle type conversion exception
+            return type(conf)
+        else:
+            return conf
+
+    @staticmethod
+    def _get_node(config: DictConfig, key: str, default: Any = None, type=None) -> Any:
+        """ Look up a key by walking the config nodes. """
         key_list = key.split(".")
         matched_key_list = []
-        conf = self._config
+        conf = config
         for it, k in enumerate(key_list):
             if isinstance(conf, DictConfig):
                 conf = conf.get(k, default)
@@ -159,13 +263,32 @@ class Configuration:
         Raises:
             JscmConfigError if parse configuration failed
         """
-        # The lowest priority
-        cls._config = _read_yaml_config(yaml_file)
-
         cli_config = None
         if not _DISABLE_CLI_CONFIG:
             cli_config = _read_cli_config()
 
+        cls._yaml_file, cls._cli_config = yaml_file, cli_config
+        cls._overrides = OmegaConf.create({})
+        cls._swap(_Snapshot(*cls._load(yaml_file, cli_config)))
+
+        if _PRINT_CONFIG:
+            print("* Configs: ", cls._config)
+        else:
+            print(f"* Configs: {len(cls._snapshot.leaves())} keys from {', '.join(cls._snapshot.files)}")
+
+        if cls._config.get("reload", {}).get("enabled", False):
+            cls.watch(interval=float(cls._config.reload.get("interval", 5)))
+
+    @staticmethod
+    def _load(yaml_file: str, cli_config: Optional[DictConfig]) -> Tuple[DictConfig, List[str]]:
+        """ Read and merge the configs.
+
+        :return The merged config and the files and include directories read.
+        """
+        # The lowest priority
+        config = _read_yaml_config(yaml_file)
+        files = [yaml_file]
+
         custom_configs = []
         if cli_config and cli_config.get("config_file", None):
             custom_yaml_files = cli_config.get("config_file")  # type: str
@@ -173,34 +296,165 @@ class Configuration:
             for cf in custom_yaml_files:
                 if cf:
                     custom_configs.append(_read_yaml_config(cf))
+                    files.append(cf)
 
         # Higher priority than default configurations
         if custom_configs:
-            cls._config = OmegaConf.merge(cls._config, *custom_configs)
+            config = OmegaConf.merge(config, *custom_configs)
 
         # Handle include files
         included_configs = []
-        included_files = cls._config.get("include", [])  # type: List[str]
+        included_files = config.get("include", [])  # type: List[str]
         for fl_or_dir in included_files:
             fls = []
             if fl_or_dir.endswith("/"):
                 fls += glob.glob(fl_or_dir + "*.yaml") + \
                     glob.glob(fl_or_dir + "*.yml")
+                # Files added to or removed from the directory change its mtime
+                files.append(fl_or_dir)
             else:
                 fls.append(fl_or_dir)
             for f in fls:
                 included_configs.append(_read_yaml_config(f))
+            files += fls
 
         if included_configs:
-            cls._config = OmegaConf.merge(cls._config, *included_configs)
+            config = OmegaConf.merge(config, *included_configs)
 
         # The highest priority
         if cli_config:
-            cls._config = OmegaConf.merge(cls._config, cli_config)
+            config = OmegaConf.merge(config, cli_config)
+        return config, files
+
+    @classmethod
+    def _swap(cls, snapshot: _Snapshot) -> Set[str]:
+        """ Make a snapshot the current config and notify subscribers.
+
+        :return The changed keys.
+        """
+        old, cls._snapshot = cls._snapshot, snapshot
+        cls._config = snapshot.config
+        if old is _EMPTY_SNAPSHOT:
+            return set()
+
+        changed = _changed_keys(old, snapshot)
+        for callback, prefix in cls._subscribers:
+            keys = {k for k in changed if k.startswith(prefix)}
+            if not keys:
+                continue
+            try:
+                callback(keys)
+            except Exception as e:
+                warnings.warn(f"Config subscriber {callback!r} failed: {e!r}")
+        return changed
+
+    @classmethod
+    def set(cls, key: str, value: Any) -> None:
+        """ Override a configuration value, eq. in tests or benchmarks.
+
+        Usage:
+            > Configuration.set("database.local.path", "/tmp/test.db")
+        """
+        cls.update({key: value})
+
+    @classmethod
+    def update(cls, values: Dict[str, Any]) -> Set[str]:
+        """ Override several configuration values at once, subscribers are notified once.
+
+        :return The changed keys.
+        """
+        with cls._reload_lock:
+            config = OmegaConf.merge(cls._config)
+            for key, value in values.items():
+                OmegaConf.update(cls._overrides, key, value, merge=False)
+                OmegaConf.update(config, key, value, merge=False)
+            return cls._swap(_Snapshot(config, cls._snapshot.files))
+
+    @classmethod
+    def reload(cls) -> Set[str]:
+        """ Read the config files again, in the same merge order as init_config.
+        The new config replaces the current one only if it loads and resolves,
+        then subscribers are notified of the changed keys. Values overridden by set
+        are kept.
+
+        :return The changed keys.
+        """
+        with cls._reload_lock:
+            try:
+                config, files = cls._load(cls._yaml_file, cls._cli_config)
+                snapshot = _Snapshot(OmegaConf.merge(config, cls._overrides), files)
+                failed = snapshot.unresolved - cls._snapshot.unresolved
+                if failed:
+                    raise ConfigError(f"Can not resolve: {', '.join(sorted(failed))}")
+            except Exception as e:
+                warnings.warn(f"Failed to reload configs, keeping the current ones: {e}")
+                return set()
+            return cls._swap(snapshot)
 
-        # TODO(P1): Support load yaml dynamically.
+    @classmethod
+    def subscribe(cls, callback: Callable[[Set[str]], None], prefix: str = "") -> None:
+        """ Call back with the changed keys starting with prefix whenever the config changes.
+        Callbacks run on the thread reloading the config, and read new values by get.
+
+        Usage:
+            > Configuration.subscribe(on_change, prefix="database.")
+        """
+        with cls._reload_lock:
+            if (callback, prefix) not in cls._subscribers:
+                cls._subscribers += ((callback, prefix),)
+
+    @classmethod
+    def unsubscribe(cls, callback: Callable[[Set[str]], None]) -> None:
+        with cls._reload_lock:
+            cls._subscribers = tuple(s for s in cls._subscribers if s[0] != callback)
+
+    @classmethod
+    def _files_signature(cls) -> Tuple[Tuple[str, Optional[Tuple[int, int]]], ...]:
+        signature = []
+        for f in cls._snapshot.files:
+            try:
+                st = os.stat(f)
+                signature.append((f, (st.st_mtime_ns, st.st_size)))
+            except OSError:
+                signature.append((f, None))
+        return tuple(signature)
 
-        print("* Configs: ", cls._config)
+    @classmethod
+    def watch(cls, interval: float = 5.0) -> None:
+        """ Poll the config files and include directories every interval seconds,
+        and reload the config when any of them changes.
+        """
+        if cls._watcher is not None:
+            return
+        stop = threading.Event()
+
+        def _watch():
+            signature = cls._files_signature()
+            while not stop.wait(interval):
+                current = cls._files_signature()
+                if current != signature:
+                    signature = current
+                    cls.reload()
+
+        thread = threading.Thread(target=_watch, name="config-watcher", daemon=True)
+        cls._watcher, cls._watch_interval = (thread, stop), interval
+        thread.start()
+
+    @classmethod
+    def stop_watching(cls) -> None:
+        if cls._watcher is not None:
+            thread, stop = cls._watcher
+            cls._watcher = None
+            stop.set()
+            thread.join()
+
+    @classmethod
+    def _after_fork(cls) -> None:
+        # The lock may have been held by another thread, and threads do not survive a fork
+        cls._reload_lock = threading.Lock()
+        if cls._watcher is not None:
+            cls._watcher = None
+            cls.watch(cls._watch_interval)
 
     @classmethod
     def get_config(cls):
@@ -215,3 +469,7 @@ class Configuration:
 
         """
         return cls()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=Configuration._after_fork)
@@ -0,0 +1,97 @@
+__all__ = [
+    "install_counters",
+]
+
+from typing import List, Sequence
+
+from sqlalchemy import Engine, func, literal, text
+from sqlalchemy import delete as _delete
+from sqlalchemy import insert as _insert
+from sqlalchemy import select as _select
+
+from models import TableCount
+
+# Comparison operators matching NULL to NULL
+_NULL_SAFE_EQUALS = {"sqlite": "IS", "mysql": "<=>"}
+_EVENTS = ("INSERT", "UPDATE", "DELETE")
+
+
+def _trigger_name(table_name: str, event: str) -> str:
+    return f"{table_name}_counts_{event.lower()}"
+
+
+def _count_statements(quote, counts: str, table_name: str, column: str, eq: str,
+                      row: str, delta: int, when: str) -> List[str]:
+    """ SQL adding delta to the count of the value of column in row (NEW or OLD). """
+    match = (f"table_name = '{table_name}' AND column_name = '{column}' "
+             f"AND value {eq} {row}.{quote(column)}")
+    statements = [f"UPDATE {counts} SET count = count + ({delta}) WHERE {match}{when}"]
+    if delta > 0:
+        # The first row having the value
+        statements.append(
+            f"INSERT INTO {counts} (table_name, column_name, value, count) "
+            f"SELECT '{table_name}', '{column}', {row}.{quote(column)}, {delta} FROM (SELECT 1) AS one "
+            f"WHERE NOT EXISTS (SELECT 1 FROM {counts} WHERE {match}){when}")
+    return statements
+
+
+def _trigger_ddl(engine: Engine, table, columns: Sequence[str], event: str) -> str:
+    quote = engine.dialect.identifier_preparer.quote
+    eq = _NULL_SAFE_EQUALS[engine.dialect.name]
+    counts = quote(TableCount.__tablename__)
+    # Soft-deleted rows are not counted
+    soft_deletes = "deleted" in table.__table__.columns
+
+    statements = []
+    for column in columns:
+        when = ""
+        if event == "UPDATE":
+            # Updates only move the rows whose value or deletion changes
+            unchanged = f"OLD.{quote(column)} {eq} NEW.{quote(column)}"
+            if soft_deletes:
+                unchanged += f" AND OLD.{quote('deleted')} {eq} NEW.{quote('deleted')}"
+            when = f" AND NOT ({unchanged})"
+        if event in ("UPDATE", "DELETE"):
+            live = f" AND OLD.{quote('deleted')} = 0" if soft_deletes else ""
+            statements += _count_statements(quote, counts, table.__tablename__, column, eq, "OLD", -1, when + live)
+        if event in ("INSERT", "UPDATE"):
+            live = f" AND NEW.{quote('deleted')} = 0" if soft_deletes else ""
+            statements += _count_statements(quote, counts, table.__tablename__, column, eq, "NEW", 1, when + live)
+
+    body = "".join(f"    {s};\n" for s in statements)
+    return (f"CREATE TRIGGER {quote(_trigger_name(table.__tablename__, event))} "
+            f"AFTER {event} ON {quote(table.__tablename__)} FOR EACH ROW\n"
+            f"BEGIN\n{body}END")
+
+
+def install_counters(engine: Engine, table, columns: Sequence[str]) -> None:
+    """ Keep the row counts per value of columns in TableCount, by triggers on inserts,
+    updates and deletes of the table, so that counting by a value is a single row read.
+    Soft-deleted rows are not counted. Existing triggers are replaced and the counts
+    recomputed.
+
+    On MySQL, DDL commits implicitly, so writes running while counters get installed
+    may be missed until the next install.
+    """
+    if engine.dialect.name not in _NULL_SAFE_EQUALS:
+        raise NotImplementedError(f"Counters are not supported on {engine.dialect.name}")
+    for column in columns:
+        if not column.isidentifier() or column not in table.__table__.columns:
+            raise ValueError(f"Unknown column '{column}' of table '{table.__tablename__}'")
+
+    quote = engine.dialect.identifier_preparer.quote
+    TableCount.__table__.create(engine, checkfirst=True)
+    with engine.begin() as conn:
+        for event in _EVENTS:
+            conn.execute(text(f"DROP TRIGGER IF EXISTS {quote(_trigger_name(table.__tablename__, event))}"))
+            if columns:
+                conn.execute(text(_trigger_ddl(engine, table, columns, event)))
+
+        conn.execute(_delete(TableCount).where(TableCount.table_name == table.__tablename__))
+        for column in columns:
+            col = getattr(table, column)
+            statement = _select(literal(table.__tablename__), literal(column), col, func.count()).group_by(col)
+            if "deleted" in table.__table__.columns:
+                statement = statement.where(~table.__table__.c.deleted)
+            conn.execute(_insert(TableCount).from_select(
+                ["table_name", "column_name", "value", "count"], statement))
@@ -1,8 +1,10 @@
 __all__ = [
     "ModelDBO",
+    "AsyncModelDBO",
 ]
 
 
+from async_base_dbo import AsyncBaseDBO
 from base_dbo import BaseDBO
 from models import (
     Table
@@ -11,3 +13,9 @@ from models import (
 
 class ModelDBO(BaseDBO[Table]):
     _table = Table
+    _conflict_keys = ["model_id", "model_version"]
+
+
+class AsyncModelDBO(AsyncBaseDBO[Table]):
+    _table = Table
+    _conflict_keys = ["model_id", "model_version"]
@@ -0,0 +1,189 @@
+# Load model manifests into the database in parallel.
+#
+# Usage:
+#   python loader.py loader.manifests=[a.jsonl,b.json] [loader.processes=4] [loader.batch_size=1000]
+__all__ = [
+    "ManifestError",
+    "parse_manifest",
+    "load_manifests",
+]
+
+import json
+import multiprocessing
+import os
+from concurrent.futures import ProcessPoolExecutor
+from itertools import islice
+from typing import Any, Dict, Iterable, Iterator, List, Optional, Tuple
+
+from cache import invalidate_table_cache
+from config import Configuration
+from logger import logger
+from manager import DBManager
+from models import Table
+
+# Errors reported per manifest, the rest are only counted
+_MAX_ERRORS = 100
+# Columns a manifest record may set, with their maximum lengths (None if unbounded).
+# Versions and deletions are kept by the DBO.
+_COLUMNS = {c.name: getattr(c.type, "length", None)
+            for c in Table.__table__.columns
+            if not c.primary_key and c.name not in ("row_version", "updated_at", "deleted")}
+_REQUIRED_COLUMNS = ("model_id", "model_version")
+
+
+class ManifestError(Exception):
+    ...
+
+
+def _validate(record: Any) -> Optional[str]:
+    """ :return Why the record is invalid, None if it is valid. """
+    if not isinstance(record, dict):
+        return f"expected an object, got {type(record).__name__}"
+    unknown = record.keys() - _COLUMNS.keys()
+    if unknown:
+        return f"unknown columns {sorted(unknown)}"
+    for column in _REQUIRED_COLUMNS:
+        if not record.get(column):
+            return f"missing '{column}'"
+    for column, value in record.items():
+        if value is None:
+            continue
+        if not isinstance(value, str):
+            return f"'{column}' must be a string, got {type(value).__name__}"
+        length = _COLUMNS[column]
+        if length is not None and len(value) > length:
+            return f"'{column}' is longer than {length}"
+    return None
+
+
+def _read_records(path: str) -> Iterator[Tuple[int, Any]]:
+    """ Yield (line or item number, record) of a JSON Lines (.jsonl) or JSON array file. """
+    if path.endswith(".jsonl"):
+        with open(path) as f:
+            for n, line in enumerate(f, 1):
+                if not line.strip():
+                    continue
+                try:
+                    yield n, json.loads(line)
+                except ValueError as e:
+                    yield n, ManifestError(f"invalid JSON: {e}")
+        return
+
+    try:
+        with open(path) as f:
+            records = json.load(f)
+    except ValueError as e:
+        raise ManifestError(f"{path}: invalid JSON: {e}")
+    if not isinstance(records, list):
+        raise ManifestError(f"{path}: expected a list of records")
+    yield from enumerate(records, 1)
+
+
+def _validated_records(path: str) -> Iterator[Tuple[int, Any, Optional[str]]]:
+    """ Yield (line or item number, record, why it is invalid or None). """
+    for n, record in _read_records(path):
+        error = str(record) if isinstance(record, ManifestError) else _validate(record)
+        yield n, record, error
+
+
+def parse_manifest(path: str) -> Tuple[List[Dict[str, Any]], List[str]]:
+    """ Read and validate the records of a manifest.
+
+    :return The valid records, and the errors of the invalid ones as 'path:n: reason'.
+    """
+    records, errors = [], []
+    for n, record, error in _validated_records(path):
+        if error is None:
+            records.append(record)
+        else:
+            errors.append(f"{path}:{n}: {error}")
+    return records, errors
+
+
+def _init_worker(pool_size: int) -> None:
+    # The pools inherited by the fork are already dropped, see DBManager._after_fork.
+    # A worker writes one batch at a time, so it needs few connections.
+    DBManager.resize_pool(pool_size, max_overflow=0)
+
+
+def _load_manifest(path: str, batch_size: int) -> Tuple[int, int, List[str]]:
+    """ Parse a manifest and upsert its valid records in batches, in a worker.
+
+    :return The numbers of loaded and invalid records, and the first errors.
+    """
+    loaded, invalid, errors = 0, 0, []
+
+    def valid_records():
+        nonlocal invalid
+        for n, record, error in _validated_records(path):
+            if error is None:
+                yield record
+                continue
+            invalid += 1
+            if len(errors) < _MAX_ERRORS:
+                errors.append(f"{path}:{n}: {error}")
+
+    try:
+        records = valid_records()
+        while True:
+            batch = list(islice(records, batch_size))
+            if not batch:
+                break
+            loaded += DBManager.model.upsert(batch, chunk_size=batch_size)
+    except (OSError, ManifestError) as e:
+        errors.append(str(e))
+    return loaded, invalid, errors
+
+
+def load_manifests(paths: Iterable[str],
+                   processes: Optional[int] = None,
+                   batch_size: int = 1000,
+                   pool_size: int = 1,
+                   ) -> Dict[str, Any]:
+    """ Parse, validate and upsert model manifests with a pool of forked processes,
+    one manifest per task. Records are keyed by (model_id, model_version), so loading
+    a manifest again updates its models.
+    :params paths - JSON Lines (.jsonl) or JSON array files of Table records.
+    :params processes - The number of workers, the number of CPUs by default.
+    :params batch_size - The number of records per write (transaction).
+    :params pool_size - The connection pool size of each worker.
+
+    :return {"files", "loaded", "invalid", "errors"}, errors holding the first ones of
+            each manifest.
+    """
+    DBManager.get_instance()
+    paths = list(paths)
+    report = {"files": len(paths), "loaded": 0, "invalid": 0, "errors": []}
+    if not paths:
+        return report
+
+    processes = min(processes or os.cpu_count() or 1, len(paths))
+    # Workers inherit the initialized DBManager and Configuration
+    context = multiprocessing.get_context("fork")
+    try:
+        with ProcessPoolExecutor(max_workers=processes,
+                                 mp_context=context,
+                                 initializer=_init_worker,
+                                 initargs=(pool_size,)) as pool:
+            for loaded, invalid, errors in pool.map(_load_manifest, paths, [batch_size] * len(paths)):
+                report["loaded"] += loaded
+                report["invalid"] += invalid
+                report["errors"] += errors
+    finally:
+        # Rows written by the workers are not known to the caches of this process
+        invalidate_table_cache(DBManager._engine, Table.__tablename__)
+
+    logger.info(f"* Loaded {report['loaded']} models from {len(paths)} manifests, "
+                f"{report['invalid']} invalid records")
+    return report
+
+
+if __name__ == "__main__":
+    Configuration.init_config()
+    DBManager.init()
+    config = Configuration.get_config()
+    result = load_manifests(list(config.get("loader.manifests", default=[])),
+                            processes=config.get("loader.processes", type=int),
+                            batch_size=config.get("loader.batch_size", default=1000, type=int),
+                            pool_size=config.get("loader.pool_size", default=1, type=int))
+    print(json.dumps(result, indent=2))
@@ -3,19 +3,68 @@ __all__ = [
 ]
 
 import os
-from sqlalchemy import Engine, create_engine
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from typing import Any, Callable, ContextManager, Dict, List, Optional, Set, Tuple, TypeVar
+
+from sqlalchemy import Engine, create_engine, event
+from sqlalchemy.ext.asyncio import AsyncEngine, AsyncSession, create_async_engine
 from sqlalchemy.orm import Session
+from sqlalchemy.pool import QueuePool
 
+from advisor import IndexAdvisor
 from config import Configuration
 from logger import logger
+from metrics import QueryStats
+from retry_policy import RetryPolicy, retryable, set_retry_policy
+from routing import ReplicaRouter
+from transaction import Transaction, detached_context, transaction
+
+from dbo import AsyncModelDBO, ModelDBO
+from models import Base
+from schema import schema_digest, stamp_schema, stored_schema_digest
+
+_RT = TypeVar("_RT")
+
+# SQLite PRAGMAs configurable under 'database.local'
+_SQLITE_PRAGMAS = ("journal_mode", "synchronous", "busy_timeout", "cache_size", "mmap_size", "temp_store")
 
-from dbo import ModelDBO
+
+class _BoundDBO(object):
+    """ A DBO of DBManager, bound to the engines on first access (see DBManager._init_tables),
+    so that processes never using it skip the schema checks. None before DBManager.init().
+    """
+
+    def __set_name__(self, owner, name: str) -> None:
+        self.attr = f"_{name}"
+
+    def __get__(self, obj, owner):
+        if not owner._bound and owner._engine is not None:
+            owner._init_tables()
+        return getattr(owner, self.attr)
 
 
 class DBManager(object):
     _engine: Engine = None
+    _async_engine: AsyncEngine = None
+
+    model: ModelDBO = _BoundDBO()
+    async_model: AsyncModelDBO = _BoundDBO()
+    _model: Optional[ModelDBO] = None
+    _async_model: Optional[AsyncModelDBO] = None
+    # Whether the DBOs are bound to the current engines
+    _bound = False
+    _bind_lock = threading.Lock()
+    # Threads running DBManager.gather calls, one pool per number of workers, as
+    # concurrent gathers may still submit to a pool
+    _gather_pools: Dict[int, ThreadPoolExecutor] = {}
+    _gather_lock = threading.Lock()
 
-    model: ModelDBO = None
+    index_advisor: IndexAdvisor = None
+    _router: ReplicaRouter = None
+    _query_stats: QueryStats = None
+    _purger: Optional[Tuple[threading.Thread, threading.Event]] = None
 
     def __init__(self) -> None:
         pass
@@ -24,15 +73,148 @@ class DBManager(object):
     def engine(self):
         return self._engine
 
+    @property
+    def async_engine(self):
+        return self._async_engine
+
     def get_session(self, *args, **kwargs) -> Session:
         return Session(self._engine, *args, **kwargs)
 
+    def get_async_session(self, *args, **kwargs) -> AsyncSession:
+        return AsyncSession(self._async_engine, *args, **kwargs)
+
+    @classmethod
+    def unit_of_work(cls) -> ContextManager[Transaction]:
+        """ Run all DBO calls within the context in one transaction (one connection and
+        one commit), rolled back if an exception is raised.
+
+        Usage:
+            with DBManager.unit_of_work():
+                DBManager.model.insert(...)
+                DBManager.model.update(...)
+        """
+        return transaction(cls._engine)
+
+    @classmethod
+    @retryable(idempotent=False)
+    def run_in_transaction(cls, func: Callable[..., _RT], *args, **kwargs) -> _RT:
+        """ Call func within a unit of work, retrying the whole unit on transient errors
+        that rolled it back (see RetryPolicy).
+        """
+        with cls.unit_of_work():
+            return func(*args, **kwargs)
+
+    @classmethod
+    def gather(cls,
+               *calls: Callable[[], Any],
+               max_workers: Optional[int] = None,
+               timeout: Optional[float] = None,
+               return_exceptions: bool = False,
+               ) -> List[Any]:
+        """ Run independent DBO reads concurrently, each on its own session, so that the
+        whole takes as long as the slowest one.
+        :params calls - Callables without arguments, eq. functools.partial(DBManager.model.select, ...).
+        :params max_workers - Threads running the calls, 'database.gather.max_workers' by default,
+                              capped by the connection pool of the engine.
+        :params timeout - Seconds each call may run, None for no limit. The clock of a call
+                          starts when a worker picks it up, so calls queued behind busy
+                          workers are not cut short. A call still running then keeps its
+                          worker until it returns. The whole gather is bounded by the time
+                          the calls would take if each ran for timeout on the workers:
+                          calls not started by then time out without running.
+        :params return_exceptions - Whether to return the errors of failed calls (TimeoutError
+                                    for timed out ones) in place of their results, rather
+                                    than raising the first one once all calls are settled.
+
+        Calls within a unit of work run outside of it, so they do not see its uncommitted writes.
+
+        Usage:
+            models, counts = DBManager.gather(
+                partial(DBManager.model.select, where={"service_id": service_id}),
+                partial(DBManager.model.count_by, "deploy_status"))
+
+        :return The results, in the order of calls.
+        """
+        # Bind the DBOs here rather than in every worker
+        if not cls._bound and cls._engine is not None:
+            cls._init_tables()
+        pool = cls._gather_executor(max_workers)
+        # When each call got picked up by a worker
+        starts: List[Optional[float]] = [None] * len(calls)
+        started = [threading.Event() for _ in calls]
+
+        def run(i: int, call: Callable[[], Any]) -> Any:
+            starts[i] = time.monotonic()
+            started[i].set()
+            return call()
+
+        futures = [pool.submit(detached_context().run, run, i, call) for i, call in enumerate(calls)]
+
+        deadline = None
+        if timeout is not None:
+            # As many rounds of calls as workers, each taking up to timeout
+            budget = timeout * -(-len(calls) // pool._max_workers)
+            deadline = time.monotonic() + budget
+
+        results: List[Any] = []
+        errors: List[BaseException] = []
+        for i, future in enumerate(futures):
+            try:
+                remaining = None
+                if deadline is not None:
+                    # Calls stuck behind hanging ones would never start
+                    if not started[i].wait(max(0.0, deadline - time.monotonic())) and future.cancel():
+                        raise TimeoutError(f"Call {i} of gather did not start within {budget}s")
+                    started[i].wait()
+                    remaining = max(0.0, min(starts[i] + timeout, deadline) - time.monotonic())
+                results.append(future.result(remaining))
+            except TimeoutError as e:
+                if not future.cancelled() and not future.done():
+                    e = TimeoutError(f"Call {i} of gather timed out after {timeout}s")
+                results.append(e)
+                errors.append(e)
+            except Exception as e:
+                results.append(e)
+                errors.append(e)
+        if errors and not return_exceptions:
+            raise errors[0]
+        return results
+
+    @classmethod
+    def _gather_executor(cls, max_workers: Optional[int] = None) -> ThreadPoolExecutor:
+        """ Get the thread pool of gather with the wanted number of workers.
+        """
+        if max_workers is None:
+            max_workers = Configuration.get_config().get("database.gather.max_workers", default=8, type=int)
+        # More workers than connections would only wait for a checkout
+        pool = cls._engine.pool
+        if isinstance(pool, QueuePool) and pool._max_overflow >= 0:
+            max_workers = min(max_workers, pool.size() + pool._max_overflow)
+        max_workers = max(1, max_workers)
+
+        with cls._gather_lock:
+            pool = cls._gather_pools.get(max_workers)
+            if pool is None:
+                pool = cls._gather_pools[max_workers] = ThreadPoolExecutor(
+                    max_workers=max_workers, thread_name_prefix=f"dbo-gather-{max_workers}")
+            return pool
+
     @classmethod
     def init(cls):
         """
         """
         # logger = SystemLogger.get_logger(cls.__class__)
         config = Configuration.get_config()
+        set_retry_policy(RetryPolicy.from_config(config))
+
+        cls._init_engines()
+        # The DBOs get bound on first use
+        cls._bound = False
+        Configuration.subscribe(cls._on_config_change, prefix="database.")
+
+    @classmethod
+    def _init_engines(cls) -> None:
+        config = Configuration.get_config()
 
         # Get config by subscript
         db_type = config.get("database.type", default="local")
@@ -55,7 +237,41 @@ class DBManager(object):
                 f"Not supported database type '{db_type}', rollback to local SQLite database.")
             cls._engine = DBManager.init_local_engine()
 
-        cls._init_tables()
+        cls._router = None
+        replicas = cls._init_replica_engines(db_type)
+        if replicas:
+            cls._router = ReplicaRouter(
+                replicas,
+                policy=config.get("database.read_routing.policy", default="round_robin"),
+                pin_seconds=config.get("database.read_routing.pin_seconds", default=1.0, type=float))
+
+        # The async engine shares the database with the sync one, which still
+        # creates the tables at initialization.
+        if config.get("database.async", default=False):
+            if db_type == "local":
+                cls._async_engine = DBManager.init_local_async_engine()
+            else:
+                logger.warning(
+                    f"Async engine is not supported for database type '{db_type}' yet.")
+
+    @classmethod
+    def _init_replica_engines(cls, db_type: str) -> List[Engine]:
+        """ Build the engines of 'database.<type>.replicas', SQLite paths for local
+        and PSMs for RDS.
+        """
+        replicas = Configuration.get_config().get(f"database.{db_type}.replicas", default=None)
+        if not replicas:
+            return []
+        if db_type == "local":
+            engines = [DBManager.init_local_engine(path) for path in replicas]
+            # Local files only stand in for replicas, nothing replicates the schema to them
+            for engine in engines:
+                Base.metadata.create_all(engine)
+            return engines
+        if db_type == "rds":
+            return [DBManager.init_byted_rds_engine(psm) for psm in replicas]
+        logger.warning(f"Read replicas are not supported for database type '{db_type}'.")
+        return []
 
     @classmethod
     def get_instance(cls):
@@ -68,20 +284,373 @@ class DBManager(object):
 
     @classmethod
     def dispose(cls, close=True) -> None:
-        """ For multiprocessing cases.
+        """ Close the pooled connections. Forked processes do not need it, they drop
+        the inherited pools by themselves (see _after_fork).
         """
+        cls.stop_purging()
+        with cls._gather_lock:
+            pools, cls._gather_pools = cls._gather_pools, {}
+        for pool in pools.values():
+            pool.shutdown()
+        if cls._model is not None and cls._model.write_behind is not None:
+            # Drain buffered updates while the engine is still usable
+            cls._model.write_behind.close()
+            cls._model._write_behind = None
         cls._engine.dispose(close)
+        if cls._router is not None:
+            cls._router.dispose(close)
+
+    @classmethod
+    async def dispose_async(cls, close=True) -> None:
+        """ Dispose the async engine, which must be awaited on its event loop.
+        """
+        if cls._async_engine is not None:
+            await cls._async_engine.dispose(close)
+
+    @classmethod
+    def _after_fork(cls) -> None:
+        """ Replace the pools inherited from the parent process, whose connections must
+        not be shared across processes. They are dropped without being closed, as the
+        parent still uses them, and the child opens its own on demand.
+        """
+        if cls._engine is not None:
+            cls._engine.dispose(close=False)
+        if cls._async_engine is not None:
+            cls._async_engine.sync_engine.dispose(close=False)
+        if cls._router is not None:
+            cls._router.dispose(close=False)
+        if cls._model is not None and cls._model.write_behind is not None:
+            cls._model.write_behind._after_fork()
+        if cls._query_stats is not None:
+            cls._query_stats._after_fork()
+        if cls.index_advisor is not None:
+            cls.index_advisor._after_fork()
+        # The locks may have been held by other threads
+        cls._bind_lock = threading.Lock()
+        cls._gather_lock = threading.Lock()
+        # Its threads did not survive the fork
+        cls._gather_pools = {}
+        # The parent keeps purging
+        cls._purger = None
+
+    @classmethod
+    def start_purging(cls, older_than: float = 30, interval: float = 3600, batch_size: int = 1000) -> None:
+        """ Purge the soft-deleted rows and tombstones older than older_than days every
+        interval seconds in a background thread (see BaseDBO.purge_deleted).
+        """
+        if cls._purger is not None:
+            return
+        stop = threading.Event()
+
+        def _purge():
+            while not stop.wait(interval):
+                try:
+                    purged = cls.model.purge_deleted(older_than, batch_size)
+                except Exception as e:
+                    logger.exception(f"Failed to purge deleted rows: {e}")
+                    continue
+                if purged:
+                    logger.info(f"* Purged {purged} deleted rows and tombstones")
+
+        thread = threading.Thread(target=_purge, name="dbo-purger", daemon=True)
+        cls._purger = (thread, stop)
+        thread.start()
+
+    @classmethod
+    def stop_purging(cls) -> None:
+        if cls._purger is not None:
+            thread, stop = cls._purger
+            cls._purger = None
+            stop.set()
+            thread.join()
+
+    @classmethod
+    def resize_pool(cls, pool_size: int, max_overflow: int = 0) -> None:
+        """ Rebuild the engines with another pool size, eq. small pools in each worker
+        of a process pool.
+        """
+        if Configuration.get_config().get("database.type", default="local") == "rds":
+            prefix = "database.rds.args"
+        else:
+            prefix = "database.local"
+        # Applied by _on_config_change
+        Configuration.update({f"{prefix}.pool_size": pool_size, f"{prefix}.max_overflow": max_overflow})
 
     @classmethod
     def _init_tables(cls):
-        cls.model = ModelDBO(engine=cls._engine)
+        """ Bind the DBOs to the engines, creating and migrating the tables first unless
+        the schema stamped in the database matches the code (see _bootstrap_schema).
+        """
+        with cls._bind_lock:
+            if cls._bound:
+                return
+            config = Configuration.get_config()
+            counted_columns = list(config.get("database.counters", default=None) or [])
+
+            model = ModelDBO(engine=cls._engine, create_table=False)
+            async_model = None
+            if cls._router is not None:
+                model.enable_read_replicas(cls._router)
+            if cls._async_engine is not None:
+                async_model = AsyncModelDBO(engine=cls._async_engine)
+            dbos = [dbo for dbo in (model, async_model) if dbo is not None]
+            cls._bootstrap_schema(model, counted_columns)
+
+            if config.get("database.instrumentation.enabled", default=False):
+                cls._query_stats = QueryStats(
+                    slow_query_ms=config.get("database.instrumentation.slow_query_ms", type=float))
+                cls._query_stats.instrument(cls._engine)
+                if cls._async_engine is not None:
+                    cls._query_stats.instrument(cls._async_engine.sync_engine)
+                for engine in cls._router.replicas if cls._router is not None else ():
+                    cls._query_stats.instrument(engine)
+                for dbo in dbos:
+                    dbo.enable_stats(cls._query_stats)
+
+            if config.get("database.cache.enabled", default=False):
+                max_entries = config.get("database.cache.max_entries", default=1024, type=int)
+                ttl = config.get("database.cache.ttl", default=60, type=float)
+                for dbo in dbos:
+                    dbo.enable_cache(max_entries=max_entries, ttl=ttl)
+
+            if counted_columns:
+                model.enable_counters(*counted_columns, install=False)
+                if async_model is not None:
+                    async_model.enable_counters(*counted_columns)
+
+            if config.get("database.write_behind.enabled", default=False):
+                model.enable_write_behind(
+                    max_pending=config.get("database.write_behind.max_pending", default=10000, type=int),
+                    flush_size=config.get("database.write_behind.flush_size", default=500, type=int),
+                    flush_interval=config.get("database.write_behind.flush_interval", default=0.5, type=float))
+
+            if config.get("database.index_advisor", default=False):
+                cls.index_advisor = IndexAdvisor()
+                for dbo in dbos:
+                    dbo.enable_index_advisor(cls.index_advisor)
+
+            cls._model, cls._async_model = model, async_model
+            cls._bound = True
+
+            if config.get("database.purge.enabled", default=False):
+                cls.start_purging(older_than=config.get("database.purge.older_than", default=30, type=float),
+                                  interval=config.get("database.purge.interval", default=3600, type=float),
+                                  batch_size=config.get("database.purge.batch_size", default=1000, type=int))
+
+    @classmethod
+    def _bootstrap_schema(cls, model: ModelDBO, counted_columns: List[str]) -> bool:
+        """ Create all tables in one go, migrate the existing ones and install the counters,
+        unless the digest of the schema and counted columns stamped in the database
+        matches, which costs a single query on later starts.
+
+        :return Whether the schema got applied.
+        """
+        digest = schema_digest(model._engine, tuple(sorted(counted_columns)))
+        if stored_schema_digest(model._engine) == digest:
+            return False
+
+        logger.info("* Apply the database schema")
+        Base.metadata.create_all(model._engine)
+        # Columns and indexes declared after the tables got created
+        model.create_table()
+        # Also drops the triggers of columns no longer counted
+        model.enable_counters(*counted_columns)
+        stamp_schema(model._engine, digest)
+        return True
+
+    @classmethod
+    def _reload_engines(cls) -> None:
+        """ Rebuild the engines from the current config and rebind the DBOs to them.
+        Connections checked out from the old engines are left to finish their work.
+        """
+        old_engine, old_async_engine, old_router = cls._engine, cls._async_engine, cls._router
+        cls._async_engine = None
+        cls._init_engines()
+
+        if not cls._bound:
+            # Bound to the new engines on first use
+            for engine in (old_engine, old_async_engine and old_async_engine.sync_engine):
+                if engine is not None:
+                    engine.dispose(close=False)
+            if old_router is not None:
+                old_router.dispose(close=False)
+            return
+
+        cls._model._engine = cls._engine
+        cls._model._router = cls._router
+        # The database itself may have moved
+        cls._bootstrap_schema(cls._model, list(cls._model._counted_columns))
+        if cls._async_model is not None:
+            if cls._async_engine is not None:
+                cls._async_model._engine = cls._async_engine
+            else:
+                # The async engine got disabled, keep serving on the old one
+                cls._async_engine = old_async_engine
+                old_async_engine = None
+        for dbo in (cls._model, cls._async_model):
+            if dbo is not None and dbo.cache is not None:
+                # Results cached from the old database or replicas, and the cache of the new one
+                dbo.cache.invalidate()
+                dbo.enable_cache(max_entries=dbo.cache.max_entries, ttl=dbo.cache.ttl)
+        if cls._query_stats is not None:
+            cls._query_stats.instrument(cls._engine)
+            if cls._async_engine is not None and cls._async_engine is not old_async_engine:
+                cls._query_stats.instrument(cls._async_engine.sync_engine)
+            for engine in cls._router.replicas if cls._router is not None else ():
+                cls._query_stats.instrument(engine)
+
+        old_engine.dispose(close=False)
+        if old_router is not None:
+            old_router.dispose(close=False)
+        if old_async_engine is not None:
+            old_async_engine.sync_engine.dispose(close=False)
+
+    @classmethod
+    def _on_config_change(cls, changed: Set[str]) -> None:
+        """ Apply changed 'database.*' settings, see Configuration.subscribe.
+        """
+        config = Configuration.get_config()
+        logger.info(f"* Database configs changed: {', '.join(sorted(changed))}")
+
+        if any(k.startswith(("database.type", "database.local.", "database.rds.", "database.read_routing."))
+               for k in changed):
+            cls._reload_engines()
+
+        if any(k.startswith("database.retry.") for k in changed):
+            set_retry_policy(RetryPolicy.from_config(config))
+
+        if cls._query_stats is not None and "database.instrumentation.slow_query_ms" in changed:
+            cls._query_stats.slow_query_ms = config.get(
+                "database.instrumentation.slow_query_ms", type=float)
+
+        for dbo in (cls._model, cls._async_model):
+            if dbo is not None and dbo.cache is not None:
+                dbo.cache.max_entries = config.get("database.cache.max_entries", default=1024, type=int)
+                dbo.cache.ttl = config.get("database.cache.ttl", default=60, type=float)
+
+        toggled = {"database.async", "database.cache.enabled", "database.instrumentation.enabled",
+                   "database.index_advisor", "database.write_behind.enabled",
+                   "database.purge.enabled"}
+        toggled |= {k for k in changed if k.startswith("database.counters")}
+        if changed & toggled:
+            logger.warning(f"Changes of {', '.join(sorted(changed & toggled))} "
+                           f"take effect on the next DBManager.init().")
+
+    @classmethod
+    def stats(cls) -> Dict[str, Any]:
+        """ Get a snapshot of query statistics: per 'table.operation' latency histograms and
+        rows, retries, pool checkout wait times and the number of slow queries, along with
+        the write-behind buffer under 'write_behind' (see write_behind_stats).
+        Requires 'database.instrumentation.enabled' to be true, or write-behind to be enabled
+        for its statistics alone.
+        """
+        write_behind = cls.write_behind_stats()
+        if cls._query_stats is None:
+            if write_behind is not None:
+                return {"write_behind": write_behind}
+            raise Exception(
+                "Instrumentation is not enabled, set 'database.instrumentation.enabled' to true.")
+        stats = cls._query_stats.snapshot()
+        if write_behind is not None:
+            stats["write_behind"] = write_behind
+        return stats
+
+    @classmethod
+    def write_behind_stats(cls) -> Optional[Dict[str, Any]]:
+        """ Get a snapshot of the write-behind buffer: pending updates, coalesced, flushed
+        and dropped ones, blocked writers and flush latencies. None if write-behind is not
+        enabled, regardless of 'database.instrumentation.enabled'.
+        """
+        if not cls._bound and cls._engine is not None:
+            cls._init_tables()
+        if cls._model is None or cls._model.write_behind is None:
+            return None
+        return cls._model.write_behind.snapshot()
+
+    @classmethod
+    def index_report(cls, only_uncovered: bool = True) -> List[Dict[str, Any]]:
+        """ Report the queried where/order_by columns not served by an index, with their
+        EXPLAIN output. Requires 'database.index_advisor' to be enabled.
+        """
+        if not cls._bound and cls._engine is not None:
+            cls._init_tables()
+        if cls.index_advisor is None:
+            raise Exception(
+                "Index advisor is not enabled, set 'database.index_advisor' to true.")
+        return cls.index_advisor.report(cls._engine, only_uncovered=only_uncovered)
 
     @staticmethod
-    def init_local_engine():
+    def init_local_engine(path: Optional[str] = None):
         """ Initialize a SQLite database.
+        :params path - The database file, 'database.local.path' by default.
+        """
+        path = DBManager._local_db_path(path)
+        url = "sqlite:///{}?check_same_thread=False".format(path)
+        pragmas = DBManager._sqlite_pragmas()
+
+        kwargs = {}
+        if str(pragmas.get("journal_mode", "")).lower() == "wal":
+            # WAL lets readers run alongside a writer, so pool enough connections for them
+            config = Configuration.get_config()
+            kwargs = dict(poolclass=QueuePool,
+                          pool_size=config.get("database.local.pool_size", default=5, type=int),
+                          max_overflow=config.get("database.local.max_overflow", default=10, type=int))
+
+        # TODO: confirm isolation level setting
+        engine = DBManager.init_engine(url=url, isolation_level=None, **kwargs)
+        DBManager.set_sqlite_pragmas(engine, pragmas)
+        return engine
+
+    @staticmethod
+    def init_local_async_engine():
+        """ Initialize a SQLite database accessed through aiosqlite.
         """
+        path = DBManager._local_db_path()
+        url = "sqlite+aiosqlite:///{}".format(path)
+        engine = DBManager.init_async_engine(url=url)
+        DBManager.set_sqlite_pragmas(engine.sync_engine, DBManager._sqlite_pragmas())
+        return engine
+
+    @staticmethod
+    def _sqlite_pragmas() -> Dict[str, Any]:
         config = Configuration.get_config()
-        path = config.get("database.local.path", default=os.path.join("sqlite/model.db"))  # type: str
+        pragmas = {}
+        for name in _SQLITE_PRAGMAS:
+            value = config.get(f"database.local.{name}")
+            if value is not None:
+                pragmas[name] = value
+        return pragmas
+
+    @staticmethod
+    def set_sqlite_pragmas(engine: Engine, pragmas: Dict[str, Any]) -> None:
+        """ Apply PRAGMAs on every new connection of a SQLite engine.
+        :params engine - The SQLite engine.
+        :params pragmas - PRAGMA names (See _SQLITE_PRAGMAS) and values.
+        """
+        statements = []
+        for name, value in pragmas.items():
+            if name not in _SQLITE_PRAGMAS:
+                raise ValueError(f"Not supported SQLite PRAGMA '{name}'")
+            if not isinstance(value, int) and not str(value).isalnum():
+                raise ValueError(f"Invalid value of SQLite PRAGMA '{name}': {value!r}")
+            statements.append(f"PRAGMA {name}={value}")
+        if not statements:
+            return
+
+        @event.listens_for(engine, "connect")
+        def _on_connect(dbapi_connection, connection_record):
+            cursor = dbapi_connection.cursor()
+            try:
+                for statement in statements:
+                    cursor.execute(statement)
+            finally:
+                cursor.close()
+
+    @staticmethod
+    def _local_db_path(path: Optional[str] = None) -> str:
+        config = Configuration.get_config()
+        if path is None:
+            path = config.get("database.local.path", default=os.path.join("sqlite/model.db"))  # type: str
 
         # If the file path is relative, we'll place it to the data directory.
         if not path.startswith("/"):
@@ -92,10 +661,7 @@ class DBManager(object):
         db_dir_path = os.path.dirname(path)
         if not os.path.exists(db_dir_path):
             os.makedirs(db_dir_path, exist_ok=True)
-
-        url = "sqlite:///{}?check_same_thread=False".format(path)
-        # TODO: confirm isolation level setting
-        return DBManager.init_engine(url=url, isolation_level=None)
+        return path
 
     @staticmethod
     def init_mysql_engine():
@@ -103,12 +669,15 @@ class DBManager(object):
         raise NotImplementedError
 
     @staticmethod
-    def init_byted_rds_engine():
+    def init_byted_rds_engine(psm: Optional[str] = None):
+        """ Initialize an RDS database.
+        :params psm - The PSM of the database, 'database.rds.psm' by default.
+        """
         from bytedmysql import sqlalchemy_init
         sqlalchemy_init()
 
         config = Configuration.get_config()
-        rds_psm = config.get("database.rds.psm")
+        rds_psm = psm or config.get("database.rds.psm")
         if config.get("core.region") != "boe":
             rds_psm = rds_psm + ".service.lf"
         url = "mysql+pymysql://:@/?charset=utf8mb4&&db_psm={}".format(rds_psm)
@@ -123,3 +692,12 @@ class DBManager(object):
     def init_engine(url: str, **kwargs) -> Engine:
         logger.info(f"* Connect to database: {url}")
         return create_engine(url=url, **kwargs)
+
+    @staticmethod
+    def init_async_engine(url: str, **kwargs) -> AsyncEngine:
+        logger.info(f"* Connect to database (async): {url}")
+        return create_async_engine(url, **kwargs)
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=DBManager._after_fork)
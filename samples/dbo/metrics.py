@@ -0,0 +1,201 @@
+__all__ = [
+    "Histogram",
+    "QueryStats",
+]
+
+import bisect
+import threading
+import time
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import Engine, event
+
+from logger import logger
+
+# Upper bounds (ms) of latency histogram buckets, the last bucket is unbounded
+_BUCKET_BOUNDS_MS = (0.1, 0.25, 0.5, 1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000)
+_DESCRIBE_CACHE_SIZE = 1024
+_MAX_LOGGED_PARAMS_LEN = 500
+
+
+class Histogram(object):
+    """ A latency histogram over fixed buckets, cheap enough to update on every query.
+    Not thread-safe, callers hold a lock.
+    """
+
+    def __init__(self) -> None:
+        self.counts = [0] * (len(_BUCKET_BOUNDS_MS) + 1)
+        self.count = 0
+        self.total_ms = 0.0
+        self.max_ms = 0.0
+
+    def observe(self, ms: float) -> None:
+        self.counts[bisect.bisect_left(_BUCKET_BOUNDS_MS, ms)] += 1
+        self.count += 1
+        self.total_ms += ms
+        if ms > self.max_ms:
+            self.max_ms = ms
+
+    def percentile(self, q: float) -> float:
+        """ The upper bound (ms) of the bucket holding the q-th quantile. """
+        if not self.count:
+            return 0.0
+        rank = q * self.count
+        seen = 0
+        for i, n in enumerate(self.counts):
+            seen += n
+            if seen >= rank:
+                return _BUCKET_BOUNDS_MS[i] if i < len(_BUCKET_BOUNDS_MS) else self.max_ms
+        return self.max_ms
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {
+            "count": self.count,
+            "total_ms": self.total_ms,
+            "mean_ms": self.total_ms / self.count if self.count else 0.0,
+            "max_ms": self.max_ms,
+            "p50_ms": self.percentile(0.5),
+            "p90_ms": self.percentile(0.9),
+            "p99_ms": self.percentile(0.99),
+            "buckets": {f"le_{b}": n for b, n in zip(_BUCKET_BOUNDS_MS + ("inf",), self.counts)},
+        }
+
+
+def _describe(context, statement: str) -> Tuple[str, str]:
+    """ Get the (table, operation) of an executed statement. """
+    compiled = getattr(context, "compiled", None)
+    if compiled is None:
+        # Textual SQL
+        return "", statement.lstrip().split(" ", 1)[0].lower()
+
+    if not hasattr(compiled, "isinsert"):
+        # DDL, eq. CREATE TABLE
+        op = "ddl"
+    elif compiled.isinsert:
+        op = "insert"
+    elif compiled.isupdate:
+        op = "update"
+    elif compiled.isdelete:
+        op = "delete"
+    else:
+        op = "select"
+
+    table = getattr(compiled.statement, "table", None)
+    if table is None:
+        froms = getattr(compiled.statement, "get_final_froms", lambda: [])()
+        table = froms[0] if froms else None
+    return getattr(table, "name", ""), op
+
+
+class QueryStats(object):
+    """ Per-table, per-operation latency histograms and row counts of executed statements,
+    retry counts and pool checkout wait times, collected from SQLAlchemy engine events.
+
+    Statements slower than slow_query_ms are logged with their parameters.
+    """
+
+    def __init__(self, slow_query_ms: Optional[float] = None) -> None:
+        self.slow_query_ms = slow_query_ms
+        self._lock = threading.Lock()
+        self._queries: Dict[Tuple[str, str], Histogram] = {}
+        self._rows: Dict[Tuple[str, str], int] = {}
+        self._retries: Dict[Tuple[str, str], int] = {}
+        self._checkouts = Histogram()
+        self._slow_queries = 0
+        # SQL string -> (table, operation), statements are cached by shape so this stays small
+        self._described: Dict[str, Tuple[str, str]] = {}
+
+    def _after_fork(self) -> None:
+        # The lock may have been held by another thread
+        self._lock = threading.Lock()
+
+    def instrument(self, engine: Engine) -> None:
+        """ Start collecting the statistics of an engine.
+        """
+        event.listen(engine, "before_cursor_execute", self._before_cursor_execute)
+        event.listen(engine, "after_cursor_execute", self._after_cursor_execute)
+        self._instrument_pool(engine)
+        # Disposing an engine replaces its pool
+        event.listen(engine, "engine_disposed", self._instrument_pool)
+
+    def _instrument_pool(self, engine: Engine) -> None:
+        pool = engine.pool
+        connect = type(pool).connect.__get__(pool)
+
+        def timed_connect():
+            start = time.perf_counter()
+            try:
+                return connect()
+            finally:
+                ms = (time.perf_counter() - start) * 1e3
+                with self._lock:
+                    self._checkouts.observe(ms)
+
+        pool.connect = timed_connect
+
+    def _before_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        if context is not None:
+            context._dbo_query_start = time.perf_counter()
+
+    def _after_cursor_execute(self, conn, cursor, statement, parameters, context, executemany):
+        start = getattr(context, "_dbo_query_start", None)
+        if start is None:
+            return
+        ms = (time.perf_counter() - start) * 1e3
+
+        key = self._described.get(statement)
+        if key is None:
+            if len(self._described) >= _DESCRIBE_CACHE_SIZE:
+                self._described.clear()
+            key = self._described[statement] = _describe(context, statement)
+
+        # Rows affected by DML, selected rows are reported by the DBOs (see record_rows)
+        rowcount = cursor.rowcount if key[1] != "select" else -1
+        with self._lock:
+            histogram = self._queries.get(key)
+            if histogram is None:
+                histogram = self._queries[key] = Histogram()
+            histogram.observe(ms)
+            if rowcount > 0:
+                self._rows[key] = self._rows.get(key, 0) + rowcount
+
+        if self.slow_query_ms is not None and ms >= self.slow_query_ms:
+            with self._lock:
+                self._slow_queries += 1
+            params = repr(parameters)
+            if len(params) > _MAX_LOGGED_PARAMS_LEN:
+                params = params[:_MAX_LOGGED_PARAMS_LEN] + "..."
+            logger.warning(
+                f"Slow query ({ms:.1f}ms) on '{key[0]}' {key[1]}: {statement} | params: {params}")
+
+    def record_rows(self, table: str, op: str, rows: int) -> None:
+        with self._lock:
+            self._rows[(table, op)] = self._rows.get((table, op), 0) + rows
+
+    def record_retry(self, table: str, method: str) -> None:
+        with self._lock:
+            self._retries[(table, method)] = self._retries.get((table, method), 0) + 1
+
+    def reset(self) -> None:
+        with self._lock:
+            self._queries.clear()
+            self._rows.clear()
+            self._retries.clear()
+            self._checkouts = Histogram()
+            self._slow_queries = 0
+
+    def snapshot(self) -> Dict[str, Any]:
+        """ A point-in-time copy of all statistics, keyed by 'table.operation'.
+        """
+        with self._lock:
+            queries = {}
+            for (table, op), histogram in self._queries.items():
+                stats = histogram.snapshot()
+                stats["rows"] = self._rows.get((table, op), 0)
+                queries[f"{table}.{op}"] = stats
+            return {
+                "queries": queries,
+                "retries": {f"{table}.{method}": n for (table, method), n in self._retries.items()},
+                "pool_checkout": self._checkouts.snapshot(),
+                "slow_queries": self._slow_queries,
+            }
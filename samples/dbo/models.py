@@ -1,11 +1,15 @@
 from typing import Any, Dict, List
 
-from sqlalchemy import Column, Integer, Text, DateTime, Boolean, BigInteger, func
+from sqlalchemy import Column, Integer, String, Text, DateTime, Boolean, BigInteger, Index, UniqueConstraint, func, text
 from sqlalchemy.ext.declarative import declarative_base
 
 
 __all__ = [
-    "Table"
+    "Table",
+    "TableCount",
+    "TableVersion",
+    "TableTombstone",
+    "SchemaVersion",
 ]
 
 Base = declarative_base()
@@ -25,14 +29,72 @@ class ToDictMixin:
 
 class Table(Base, ToDictMixin):
     __tablename__ = 'table'
+    __table_args__ = (
+        UniqueConstraint("model_id", "model_version", name="uq_table_model_id_version"),
+        # Lookups skip soft-deleted rows, so SQLite only indexes the live ones
+        Index("ix_table_live_service_id", "service_id", sqlite_where=text("deleted = 0")),
+        Index("ix_table_live_deploy_status", "deploy_status", sqlite_where=text("deleted = 0")),
+        Index("ix_table_live_test_status", "test_status", sqlite_where=text("deleted = 0")),
+        # Purges find soft-deleted rows by age, elsewhere through the index of updated_at
+        Index("ix_table_deleted_updated_at", "updated_at", sqlite_where=text("deleted = 1")),
+    )
     _default_select_columns = ["model_id", "model_name", "model_version", "model_description", "service_id", "publish_time", "deploy_time", "deploy_status", "test_status"]
     id = Column(Integer, primary_key=True, autoincrement=True, comment="ID")
-    model_id = Column(Text(), comment="模型的id")
+    # Indexed columns are bounded, as MySQL can not index TEXT columns without a prefix length.
+    # model_id lookups use the leading column of the unique key (model_id, model_version).
+    model_id = Column(String(255), comment="模型的id")
     model_name = Column(Text(), comment="模型的名称")
-    model_version = Column(Text(), comment="模型的版本")
+    model_version = Column(String(255), comment="模型的版本")
     model_description = Column(Text(), comment="模型的描述")
-    service_id = Column(Text(), comment="模型服务的id")
+    service_id = Column(String(255), comment="模型服务的id")
     publish_time = Column(Text(), comment="模型发布时间")
     deploy_time = Column(Text(), comment="模型部署时间")
-    deploy_status = Column(Text(), comment="模型部署状态")
-    test_status = Column(Text(), comment="模型测试状态")
+    deploy_status = Column(String(64), comment="模型部署状态")
+    test_status = Column(String(64), comment="模型测试状态")
+    # Stamped by BaseDBO on every write, see BaseDBO.select_since
+    updated_at = Column(DateTime, index=True, comment="最后修改时间")
+    row_version = Column(BigInteger, index=True, comment="最后修改的版本")
+    # Set by BaseDBO.delete(soft_deletion=True), such rows are left out of queries
+    deleted = Column(Boolean, nullable=False, default=False, server_default=text("0"), comment="是否已删除")
+
+
+class TableCount(Base):
+    """ Row counts per value of the counted columns of tables, kept by triggers (see counters.py). """
+    __tablename__ = 'table_counts'
+    __table_args__ = (
+        Index("ix_table_counts_column", "table_name", "column_name"),
+    )
+    id = Column(Integer, primary_key=True, autoincrement=True, comment="ID")
+    table_name = Column(String(64), nullable=False, comment="计数的表名")
+    column_name = Column(String(64), nullable=False, comment="计数的列名")
+    value = Column(String(255), comment="列的取值")
+    count = Column(BigInteger, nullable=False, default=0, comment="取该值的行数")
+
+
+class TableVersion(Base):
+    """ The last version stamped on the rows of each versioned table (see BaseDBO.select_since). """
+    __tablename__ = 'table_versions'
+    table_name = Column(String(64), primary_key=True, comment="表名")
+    version = Column(BigInteger, nullable=False, default=0, comment="最后分配的版本")
+
+
+class TableTombstone(Base):
+    """ Rows deleted from versioned tables, so that change feeds see deletions. """
+    __tablename__ = 'table_tombstones'
+    __table_args__ = (
+        Index("ix_table_tombstones_version", "table_name", "version"),
+    )
+    id = Column(Integer, primary_key=True, autoincrement=True, comment="ID")
+    table_name = Column(String(64), nullable=False, comment="删除行的表名")
+    row_id = Column(Integer, nullable=False, comment="删除行的id")
+    row_key = Column(Text(), comment="删除行的唯一键, JSON格式")
+    version = Column(BigInteger, nullable=False, comment="删除时的版本")
+    deleted_at = Column(DateTime, index=True, comment="删除时间")
+
+
+class SchemaVersion(Base):
+    """ The digest of the schema last applied to the database, see schema.py. """
+    __tablename__ = 'schema_versions'
+    name = Column(String(64), primary_key=True, comment="模式名")
+    digest = Column(String(64), nullable=False, comment="模式的摘要")
+    updated_at = Column(DateTime, comment="应用时间")
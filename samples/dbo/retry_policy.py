@@ -0,0 +1,159 @@
+__all__ = [
+    "RetryPolicy",
+    "classify_error",
+    "get_retry_policy",
+    "set_retry_policy",
+    "retryable",
+]
+
+import random
+from typing import Any, Callable, Optional
+
+from sqlalchemy.exc import DBAPIError
+from tenacity import retry
+
+from logger import logger
+from transaction import current_transaction
+
+# Transient errors after which the statement is known not to have been applied
+ROLLED_BACK = "rolled_back"
+# Transient errors after which the outcome of the statement is unknown
+CONNECTION_LOST = "connection_lost"
+
+# MySQL: lock wait timeout, deadlock
+_MYSQL_ROLLED_BACK = frozenset((1205, 1213))
+# MySQL: server has gone away, lost connection during query, lost connection at handshake
+_MYSQL_CONNECTION_LOST = frozenset((2006, 2013, 2055))
+# SQLite primary result codes: SQLITE_BUSY, SQLITE_LOCKED
+_SQLITE_BUSY = frozenset((5, 6))
+_SQLITE_BUSY_MESSAGES = ("database is locked", "database table is locked", "database is busy")
+
+
+def classify_error(exc: BaseException) -> Optional[str]:
+    """ Classify a database error as transient.
+
+    :return ROLLED_BACK if the failed statement was not applied (SQLite busy/locked,
+            MySQL deadlock or lock wait timeout), CONNECTION_LOST if the connection broke
+            and it may or may not have been applied, None if the error is not transient.
+    """
+    if not isinstance(exc, DBAPIError):
+        return None
+
+    orig = exc.orig
+    code = orig.args[0] if orig is not None and orig.args else None
+    if isinstance(code, int):
+        if code in _MYSQL_ROLLED_BACK:
+            return ROLLED_BACK
+        if code in _MYSQL_CONNECTION_LOST:
+            return CONNECTION_LOST
+
+    sqlite_code = getattr(orig, "sqlite_errorcode", None)
+    if sqlite_code is not None and sqlite_code & 0xff in _SQLITE_BUSY:
+        return ROLLED_BACK
+    message = str(orig).lower()
+    if any(m in message for m in _SQLITE_BUSY_MESSAGES):
+        return ROLLED_BACK
+
+    if exc.connection_invalidated:
+        return CONNECTION_LOST
+    return None
+
+
+class RetryPolicy(object):
+    """ When and how long to wait before retrying a failed DBO call.
+
+    Only transient errors are retried, see classify_error. Non-idempotent operations
+    (eq. plain inserts) are retried only when the failed attempt is known to be rolled
+    back, never after a lost connection, which may have committed it.
+
+    Waits grow exponentially with full jitter, so clients contending for the same lock
+    spread out their retries, and all attempts are bounded by a total deadline.
+    """
+
+    def __init__(self,
+                 max_attempts: int = 3,
+                 initial_wait: float = 0.05,
+                 max_wait: float = 1.0,
+                 multiplier: float = 2.0,
+                 deadline: float = 5.0,
+                 ) -> None:
+        self.max_attempts = max_attempts
+        self.initial_wait = initial_wait
+        self.max_wait = max_wait
+        self.multiplier = multiplier
+        self.deadline = deadline
+
+    @classmethod
+    def from_config(cls, config) -> "RetryPolicy":
+        """ Read the policy from 'database.retry'. """
+        return cls(max_attempts=config.get("database.retry.max_attempts", default=3, type=int),
+                   initial_wait=config.get("database.retry.initial_wait", default=0.05, type=float),
+                   max_wait=config.get("database.retry.max_wait", default=1.0, type=float),
+                   multiplier=config.get("database.retry.multiplier", default=2.0, type=float),
+                   deadline=config.get("database.retry.deadline", default=5.0, type=float))
+
+    def should_retry(self, exc: BaseException, idempotent: bool) -> bool:
+        kind = classify_error(exc)
+        return kind == ROLLED_BACK or (kind == CONNECTION_LOST and idempotent)
+
+    def should_stop(self, attempt_number: int, elapsed: float) -> bool:
+        return attempt_number >= self.max_attempts or elapsed >= self.deadline
+
+    def wait(self, attempt_number: int, elapsed: float) -> float:
+        backoff = min(self.max_wait, self.initial_wait * self.multiplier ** (attempt_number - 1))
+        return min(random.uniform(0, backoff), max(0.0, self.deadline - elapsed))
+
+
+_policy = RetryPolicy()
+
+
+def get_retry_policy() -> RetryPolicy:
+    return _policy
+
+
+def set_retry_policy(policy: RetryPolicy) -> None:
+    """ Replace the policy of all DBO methods, it applies from their next call. """
+    global _policy
+    _policy = policy
+
+
+def _stop(retry_state) -> bool:
+    return _policy.should_stop(retry_state.attempt_number, retry_state.seconds_since_start or 0)
+
+
+def _wait(retry_state) -> float:
+    return _policy.wait(retry_state.attempt_number, retry_state.seconds_since_start or 0)
+
+
+def _record_retry(retry_state) -> None:
+    dbo = retry_state.args[0] if retry_state.args else None
+    stats = getattr(dbo, "_stats", None)
+    if stats is not None:
+        stats.record_retry(dbo._table.__tablename__, retry_state.fn.__name__)
+
+
+def _retries_exhausted(retry_state) -> Any:
+    logger.warning(f"Giving up {retry_state.fn.__qualname__} after {retry_state.attempt_number} "
+                   f"attempts: {retry_state.outcome.exception()!r}")
+    # Raise the last error
+    return retry_state.outcome.result()
+
+
+def retryable(idempotent: bool = True) -> Callable:
+    """ Retry a DBO method on transient errors, following the current RetryPolicy.
+    :params idempotent - Whether running the operation twice has the same effect as once.
+
+    Calls within a unit of work are not retried: a failed statement can not be retried
+    within its transaction, the whole unit is retried instead
+    (see DBManager.run_in_transaction).
+    """
+    def _retry(retry_state) -> bool:
+        return (retry_state.outcome.failed
+                and current_transaction() is None
+                and _policy.should_retry(retry_state.outcome.exception(), idempotent))
+
+    return retry(retry=_retry,
+                 stop=_stop,
+                 wait=_wait,
+                 before_sleep=_record_retry,
+                 retry_error_callback=_retries_exhausted)
@@ -0,0 +1,54 @@
+__all__ = [
+    "ReplicaRouter",
+    "record_write",
+]
+
+import itertools
+import time
+from contextvars import ContextVar
+from typing import List
+
+from sqlalchemy import Engine
+
+_POLICIES = ("round_robin", "least_connections")
+
+# When the caller (thread or asyncio task) last wrote, see record_write
+_last_write: ContextVar[float] = ContextVar("dbo_last_write", default=float("-inf"))
+
+
+def record_write() -> None:
+    """ Pin the reads of the caller to the primary for a while, so that it reads its own
+    writes while the replicas catch up.
+    """
+    _last_write.set(time.monotonic())
+
+
+class ReplicaRouter(object):
+    """ Pick the engine to read from: one of the replicas, or the primary for callers
+    which wrote within the last pin_seconds.
+
+    Reads within a transaction never come here, they run on its (primary) session.
+    """
+
+    def __init__(self,
+                 replicas: List[Engine],
+                 policy: str = "round_robin",
+                 pin_seconds: float = 1.0,
+                 ) -> None:
+        if policy not in _POLICIES:
+            raise ValueError(f"Unknown routing policy '{policy}', expect one of {_POLICIES}")
+        self.replicas = list(replicas)
+        self.policy = policy
+        self.pin_seconds = pin_seconds
+        self._next = itertools.count()
+
+    def read_engine(self, primary: Engine) -> Engine:
+        if not self.replicas or time.monotonic() - _last_write.get() < self.pin_seconds:
+            return primary
+        if self.policy == "least_connections":
+            return min(self.replicas, key=lambda e: getattr(e.pool, "checkedout", lambda: 0)())
+        return self.replicas[next(self._next) % len(self.replicas)]
+
+    def dispose(self, close: bool = True) -> None:
+        for engine in self.replicas:
+            engine.dispose(close)
@@ -0,0 +1,64 @@
+__all__ = [
+    "schema_digest",
+    "stored_schema_digest",
+    "stamp_schema",
+]
+
+import hashlib
+from datetime import datetime, timezone
+from typing import Any, Dict, Optional, Tuple
+
+from sqlalchemy import Engine, select, update
+from sqlalchemy import insert as _insert
+from sqlalchemy.exc import DBAPIError, IntegrityError
+from sqlalchemy.schema import CreateIndex, CreateTable
+
+from models import Base, SchemaVersion
+
+# The row of SchemaVersion stamped for the tables of models.py
+_SCHEMA_NAME = "models"
+
+# Digests keyed by (dialect, settings), the DDL does not change within a process
+_digests: Dict[Tuple[str, Tuple[Any, ...]], str] = {}
+
+
+def schema_digest(engine: Engine, *settings: Any) -> str:
+    """ Hash the DDL of all tables and indexes of models.py as compiled for the dialect
+    of the engine, along with settings shaping the schema (eq. the counted columns).
+    """
+    key = (engine.dialect.name, settings)
+    digest = _digests.get(key)
+    if digest is None:
+        h = hashlib.sha256()
+        for table in Base.metadata.sorted_tables:
+            h.update(str(CreateTable(table).compile(dialect=engine.dialect)).encode())
+            for index in sorted(table.indexes, key=lambda i: i.name):
+                h.update(str(CreateIndex(index).compile(dialect=engine.dialect)).encode())
+        h.update(repr(settings).encode())
+        digest = _digests[key] = h.hexdigest()
+    return digest
+
+
+def stored_schema_digest(engine: Engine) -> Optional[str]:
+    """ :return The digest stamped in the database, None if never stamped. """
+    try:
+        with engine.connect() as conn:
+            return conn.execute(select(SchemaVersion.digest).where(SchemaVersion.name == _SCHEMA_NAME)).scalar()
+    except DBAPIError:
+        # No table yet
+        return None
+
+
+def stamp_schema(engine: Engine, digest: str) -> None:
+    """ Record the digest of the schema applied to the database. """
+    values = {"digest": digest, "updated_at": datetime.now(timezone.utc).replace(tzinfo=None)}
+    with engine.begin() as conn:
+        updated = conn.execute(update(SchemaVersion).where(SchemaVersion.name == _SCHEMA_NAME).values(values))
+        if updated.rowcount:
+            return
+    try:
+        with engine.begin() as conn:
+            conn.execute(_insert(SchemaVersion).values(name=_SCHEMA_NAME, **values))
+    except IntegrityError:
+        # Stamped concurrently by another process
+        pass
@@ -0,0 +1,82 @@
+__all__ = [
+    "Transaction",
+    "transaction",
+    "current_transaction",
+    "detached_context",
+]
+
+from contextlib import contextmanager
+from contextvars import Context, ContextVar, copy_context
+from typing import Iterator, Optional, Set
+
+from sqlalchemy import Engine
+from sqlalchemy.orm import Session
+
+from cache import invalidate_table_cache
+from routing import record_write
+
+
+class Transaction(object):
+    """ A unit of work: one session and one commit shared by all DBO calls on an engine.
+    """
+
+    def __init__(self, engine: Engine, session: Session) -> None:
+        self.engine = engine
+        self.session = session
+        # Tables written in this unit, whose caches get invalidated once committed
+        self.written_tables: Set[str] = set()
+
+
+_current_transaction: ContextVar[Optional[Transaction]] = ContextVar(
+    "dbo_current_transaction", default=None)
+
+
+def current_transaction(engine: Optional[Engine] = None) -> Optional[Transaction]:
+    """ Get the active transaction of this thread (or asyncio task).
+    :params engine - Only return the transaction if it is bound to this engine.
+    """
+    current = _current_transaction.get()
+    if current is None or (engine is not None and current.engine is not engine):
+        return None
+    return current
+
+
+def detached_context() -> Context:
+    """ Copy the context of the caller without its active transaction, eq. to run DBO
+    calls in another thread on their own sessions, as a session must not be shared
+    across threads. They do not see the uncommitted writes of the transaction.
+    """
+    context = copy_context()
+    context.run(_current_transaction.set, None)
+    return context
+
+
+@contextmanager
+def transaction(engine: Engine) -> Iterator[Transaction]:
+    """ Run all DBO calls on the engine within the context in a single transaction.
+    It is committed on exit and rolled back if an exception is raised. Nested contexts
+    on the same engine join the outer one.
+
+    Usage:
+        with transaction(engine) as tx:
+            dbo.insert(...)
+            dbo.update(...)
+    """
+    current = current_transaction(engine)
+    if current is not None:
+        yield current
+        return
+
+    with Session(engine) as session:
+        tx = Transaction(engine, session)
+        token = _current_transaction.set(tx)
+        try:
+            with session.begin():
+                yield tx
+        finally:
+            _current_transaction.reset(token)
+
+    for table_name in tx.written_tables:
+        invalidate_table_cache(engine, table_name)
+    if tx.written_tables:
+        record_write()
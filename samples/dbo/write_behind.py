@@ -0,0 +1,211 @@
+__all__ = [
+    "WriteBehindBuffer",
+]
+
+import threading
+import time
+from typing import Any, Dict, Hashable, Optional, Tuple
+
+from logger import logger
+from metrics import Histogram
+from retry_policy import classify_error
+
+
+class WriteBehindBuffer(object):
+    """ Buffer updates of a DBO and write them in batched transactions from a background
+    thread, once flush_size rows are pending or the oldest one waited flush_interval
+    seconds.
+
+    Updates of the same row are coalesced, the last value of each column wins. At most
+    max_pending rows are buffered: updates of new rows then block until a flush makes
+    room. Reads do not see buffered updates until they are flushed.
+
+    Usage:
+        buffer = dbo.enable_write_behind()
+        buffer.update({"model_id": "m", "model_version": "1"}, {"deploy_status": "ok"})
+        ...
+        buffer.close()
+    """
+
+    def __init__(self,
+                 dbo,
+                 max_pending: int = 10000,
+                 flush_size: int = 500,
+                 flush_interval: float = 0.5,
+                 ) -> None:
+        if not 0 < flush_size <= max_pending:
+            raise ValueError(f"Expect 0 < flush_size <= max_pending, got {flush_size} and {max_pending}")
+        self._dbo = dbo
+        self.max_pending = max_pending
+        self.flush_size = flush_size
+        self.flush_interval = flush_interval
+
+        # Row key -> (key clauses, fields to update)
+        self._pending: Dict[Hashable, Tuple[Dict[str, Any], Dict[str, Any]]] = {}
+        # When the oldest pending update arrived
+        self._oldest: Optional[float] = None
+        self._cond = threading.Condition()
+        # Serializes flushes of the background thread and callers
+        self._flush_lock = threading.Lock()
+        self._closed = False
+
+        self.updates = 0
+        self.coalesced = 0
+        self.flushed = 0
+        self.dropped = 0
+        self.blocked = 0
+        self.flush_latency = Histogram()
+
+        self._thread = self._start()
+
+    def _start(self) -> threading.Thread:
+        thread = threading.Thread(target=self._run, name=f"write-behind-{self._dbo.table.__tablename__}",
+                                  daemon=True)
+        thread.start()
+        return thread
+
+    def update(self,
+               key: Dict[str, Any],
+               fields: Dict[str, Any],
+               timeout: Optional[float] = None,
+               ) -> None:
+        """ Buffer an update of a row.
+        :params key - The values of the primary or a unique key of the row, see BaseDBO.update_many.
+        :params fields - Columns to be updated.
+        :params timeout - How long to wait for room in the buffer, None for no limit.
+
+        :raise TimeoutError if the buffer stays full for timeout seconds.
+        """
+        if not key:
+            raise ValueError("The key of the updated row is empty")
+        # Checked now, as a failing flush drops the whole batch
+        table = self._dbo.table
+        for k in key:
+            if k not in table.__table__.columns:
+                raise ValueError(f"Unknown column '{k}' of table '{table.__tablename__}'")
+        row = tuple(sorted(key.items()))
+        with self._cond:
+            if self._closed:
+                raise RuntimeError("The write-behind buffer is closed")
+            pending = self._pending.get(row)
+            if pending is None:
+                if len(self._pending) >= self.max_pending:
+                    self.blocked += 1
+                    self._cond.notify_all()
+                    if not self._cond.wait_for(
+                            lambda: row in self._pending or len(self._pending) < self.max_pending
+                            or self._closed, timeout):
+                        raise TimeoutError(f"The write-behind buffer stayed full for {timeout}s")
+                    if self._closed:
+                        raise RuntimeError("The write-behind buffer is closed")
+                    # Another writer may have buffered the row meanwhile
+                    pending = self._pending.get(row)
+            if pending is None:
+                pending = self._pending[row] = (dict(key), {})
+                if self._oldest is None:
+                    self._oldest = time.monotonic()
+                    # The idle background thread waits for the first update
+                    self._cond.notify_all()
+            else:
+                self.coalesced += 1
+            pending[1].update(fields)
+            self.updates += 1
+            if len(self._pending) >= self.flush_size:
+                self._cond.notify_all()
+
+    def _due_in(self) -> Optional[float]:
+        """ Seconds until the next flush is due, None if nothing is pending. """
+        if len(self._pending) >= self.flush_size:
+            return 0
+        if self._oldest is None:
+            return None
+        return max(0.0, self._oldest + self.flush_interval - time.monotonic())
+
+    def _run(self) -> None:
+        while True:
+            with self._cond:
+                due_in = self._due_in()
+                while not self._closed and due_in != 0:
+                    self._cond.wait(due_in)
+                    due_in = self._due_in()
+                if self._closed:
+                    return
+            try:
+                self.flush()
+            except Exception as e:
+                logger.exception(f"Failed to flush buffered updates of "
+                                 f"'{self._dbo.table.__tablename__}': {e}")
+                # Back off rather than spinning on requeued updates
+                with self._cond:
+                    self._cond.wait(self.flush_interval)
+
+    def flush(self) -> int:
+        """ Write all pending updates in one transaction.
+
+        :return The number of rows written.
+        """
+        with self._flush_lock:
+            with self._cond:
+                batch, self._pending, self._oldest = self._pending, {}, None
+                # Wake up writers waiting for room
+                self._cond.notify_all()
+            if not batch:
+                return 0
+
+            start = time.perf_counter()
+            try:
+                self._dbo.update_many(batch.values())
+            except Exception as e:
+                if classify_error(e) is None:
+                    self.dropped += len(batch)
+                    raise
+                self._requeue(batch)
+                raise
+            finally:
+                with self._cond:
+                    self.flush_latency.observe((time.perf_counter() - start) * 1e3)
+            self.flushed += len(batch)
+            return len(batch)
+
+    def _requeue(self, batch: Dict[Hashable, Tuple[Dict[str, Any], Dict[str, Any]]]) -> None:
+        """ Put back the updates of a failed flush, under the ones buffered meanwhile. """
+        with self._cond:
+            for row, (key, fields) in batch.items():
+                newer = self._pending.get(row)
+                if newer is not None:
+                    fields.update(newer[1])
+                self._pending[row] = (key, fields)
+            if self._oldest is None:
+                self._oldest = time.monotonic()
+
+    def close(self) -> None:
+        """ Stop the background thread and write the pending updates.
+        """
+        with self._cond:
+            if self._closed:
+                return
+            self._closed = True
+            self._cond.notify_all()
+        self._thread.join()
+        self.flush()
+
+    def _after_fork(self) -> None:
+        # The parent writes the inherited updates, and the thread did not survive the fork
+        self._cond = threading.Condition()
+        self._flush_lock = threading.Lock()
+        self._pending, self._oldest = {}, None
+        if not self._closed:
+            self._thread = self._start()
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._cond:
+            return {
+                "pending": len(self._pending),
+                "max_pending": self.max_pending,
+                "updates": self.updates,
+                "coalesced": self.coalesced,
+                "flushed": self.flushed,
+                "dropped": self.dropped,
+                "blocked": self.blocked,
+                "flush_latency": self.flush_latency.snapshot(),
+            }